@@ -0,0 +1,284 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from Lab1.main import point_coords, rect_bounds
+from instrumentation import metrics, timed
+from Lab1.spatial_index import SpatialIndex
+
+# Smaller inputs are built serially whatever the number of workers
+PARALLEL_MIN_POINTS = 1 << 15
+
+
+def as_point_array(points) -> np.ndarray:
+    """
+    Coordinates of a list of Point, an (N, 2) array or POINT_DTYPE records
+    as an (N, 2) int64 array. Float coordinates raise a ValueError rather
+    than being truncated.
+    """
+    coords = point_coords(list(points) if not isinstance(points, np.ndarray) else points)
+    if coords.dtype.kind not in 'iu':
+        raise ValueError(f'Points must have integer coordinates, got {coords.dtype}')
+    return coords.astype(np.int64, copy=False)
+
+
+def top_level(n: int) -> int:
+    """
+    Level whose single block holds all n points.
+    """
+    return max(n - 1, 0).bit_length()
+
+
+def merge_levels(order: np.ndarray, ys: np.ndarray, span: int, level: int, top: int):
+    """
+    Yield the y order and keys of levels level + 1 up to top, starting from
+    the order at level. Each level is a stable sort of the previous one on
+    the new block keys, which only has to merge two sorted runs per block.
+    """
+    while level < top:
+        level += 1
+        key = (order >> level).astype(np.int64) * span + ys[order]
+        merge = np.argsort(key, kind='stable')
+        order = order[merge]
+        yield order, key[merge]
+
+
+def build_slab(names: list, n: int, slab_level: int, span: int, begin: int, end: int):
+    """
+    Worker of ArraySegmentTree.build_levels_parallel: levels 1 to slab_level
+    of the points begin:end, written in the shared memory blocks names.
+    """
+    blocks = [SharedMemory(name=name) for name in names]
+    try:
+        ys = np.ndarray(n, dtype=np.int64, buffer=blocks[0].buf)
+        orders = np.ndarray((slab_level, n), dtype=np.int32, buffer=blocks[1].buf)
+        keys = np.ndarray((slab_level, n), dtype=np.int64, buffer=blocks[2].buf)
+        order = np.arange(begin, end, dtype=np.int32)
+        for level, (order, key) in enumerate(merge_levels(order, ys, span, 0, slab_level)):
+            orders[level, begin:end] = order
+            keys[level, begin:end] = key
+        del ys, orders, keys
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def rects_bounds(rects) -> np.ndarray:
+    """
+    (M, 4) int64 array of x_min, x_max, y_min, y_max per rectangle, from an
+    (M, 2, 2) array of corners or a sequence of rectangles as rect_bounds takes.
+    """
+    if isinstance(rects, np.ndarray):
+        corners = rects.astype(np.int64, copy=False).reshape(-1, 2, 2)
+        return np.column_stack((corners[:, :, 0].min(axis=1), corners[:, :, 0].max(axis=1),
+                                corners[:, :, 1].min(axis=1), corners[:, :, 1].max(axis=1)))
+    return np.array([rect_bounds(rect) for rect in rects], dtype=np.int64).reshape(-1, 4)
+
+
+class ArraySegmentTree(SpatialIndex):
+    """
+    Implicit segment tree (merge sort tree) of points kept in NumPy arrays.
+
+    Points are sorted by x. Level l of the tree splits the x order in blocks
+    of 2^l points, levels[l] holds the positions of the points sorted by y
+    inside each block and keys[l] the matching block * span + rank of y
+    among the span distinct y, which is sorted over the whole level, so one
+    np.searchsorted finds a y range inside any block. Ranking y keeps the
+    keys below n^2 whatever the range of the coordinates. Queries return
+    indices in the input points instead of a set of Point, duplicated
+    coordinates are reported once per index.
+    """
+    __slots__ = ['index', 'xs', 'y_values', 'span', 'levels', 'keys', 'x_cords', 'y_cords', 'result', 'counter']
+
+    @timed('build')
+    def __init__(self, points, search_area=None, workers: int = 1):
+        coords = as_point_array(points)
+        # Input indices in (x, y) order
+        self.index = np.lexsort((coords[:, 1], coords[:, 0]))
+        self.xs = coords[self.index, 0]
+        # Distinct y in order, the tree works on their ranks
+        self.y_values, ranks = np.unique(coords[self.index, 1], return_inverse=True)
+        ranks = ranks.astype(np.int64, copy=False)
+        self.span = max(len(self.y_values), 1)
+        if workers > 1 and len(ranks) >= PARALLEL_MIN_POINTS:
+            self.levels, self.keys = self.build_levels_parallel(ranks, self.span, workers)
+        else:
+            self.levels, self.keys = self.build_levels(ranks, self.span)
+
+        # Default search area used by query() without arguments
+        self.x_cords = self.y_cords = None
+        if search_area is not None:
+            x_min, x_max, y_min, y_max = rects_bounds([search_area])[0].tolist()
+            self.x_cords = (x_min, x_max)
+            self.y_cords = (y_min, y_max)
+        self.result = np.zeros(0, dtype=np.intp)
+        self.counter = 0
+
+    @staticmethod
+    def build_levels(ys: np.ndarray, span: int):
+        """
+        Per level y order of the blocks, from single points up to one block
+        with all of them.
+        """
+        order = np.arange(len(ys), dtype=np.int32)
+        levels = [order]
+        keys = [order.astype(np.int64) * span + ys]
+        for order, key in merge_levels(order, ys, span, 0, top_level(len(ys))):
+            levels.append(order)
+            keys.append(key)
+        return levels, keys
+
+    @staticmethod
+    def build_levels_parallel(ys: np.ndarray, span: int, workers: int):
+        """
+        build_levels on several processes. The x order is split in slabs of
+        2^k points, one per worker: levels up to k only sort inside blocks
+        of a slab, so each worker builds them for its slab straight into
+        shared memory. The levels above k are stitched in this process.
+        """
+        n = len(ys)
+        top = top_level(n)
+        slab_level = top_level(-(-n // workers))
+        order = np.arange(n, dtype=np.int32)
+        levels = [order]
+        keys = [order.astype(np.int64) * span + ys]
+        blocks = [SharedMemory(create=True, size=max(size, 1))
+                  for size in (ys.nbytes, 4 * slab_level * n, 8 * slab_level * n)]
+        try:
+            np.ndarray(n, dtype=np.int64, buffer=blocks[0].buf)[:] = ys
+            names = [block.name for block in blocks]
+            slab = 1 << slab_level
+            with ProcessPoolExecutor(workers) as pool:
+                list(pool.map(build_slab, *zip(*[(names, n, slab_level, span, begin, min(begin + slab, n))
+                                                 for begin in range(0, n, slab)])))
+            slab_orders = np.ndarray((slab_level, n), dtype=np.int32, buffer=blocks[1].buf)
+            slab_keys = np.ndarray((slab_level, n), dtype=np.int64, buffer=blocks[2].buf)
+            for level in range(slab_level):
+                levels.append(slab_orders[level].copy())
+                keys.append(slab_keys[level].copy())
+            del slab_orders, slab_keys
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+        for order, key in merge_levels(levels[-1], ys, span, slab_level, top):
+            levels.append(order)
+            keys.append(key)
+        return levels, keys
+
+    @timed('query')
+    def query(self, rect=None) -> np.ndarray:
+        """
+        Indices of the points inside rect, given by two corners, or inside
+        the search area of the tree when rect is None, in which case they
+        are also kept in self.result.
+        """
+        if rect is not None:
+            x_min, x_max, y_min, y_max = rect_bounds(rect)
+            return self.query_rect((x_min, x_max), (y_min, y_max))
+        self.result = self.query_rect(self.x_cords, self.y_cords)
+        return self.result
+
+    def count(self, rect) -> int:
+        """
+        Number of points inside rect without gathering their indices.
+        """
+        return int(self.query_many([rect], count_only=True)[0])
+
+    def query_rect(self, x_cords, y_cords) -> np.ndarray:
+        """
+        Indices of the points with x_cords[0] <= x <= x_cords[1] and
+        y_cords[0] <= y <= y_cords[1]. The x range is split bottom-up in
+        canonical blocks, and each one is cut to the y range by searchsorted.
+        """
+        left = int(np.searchsorted(self.xs, x_cords[0], side='left'))
+        right = int(np.searchsorted(self.xs, x_cords[1], side='right'))
+        low = int(np.searchsorted(self.y_values, y_cords[0], side='left'))
+        high = int(np.searchsorted(self.y_values, y_cords[1], side='right'))
+        parts = []
+        level = 0
+        while left < right and low < high:
+            if left & 1:
+                parts.append(self.block_range(level, left, low, high))
+                left += 1
+            if right & 1:
+                right -= 1
+                parts.append(self.block_range(level, right, low, high))
+            left >>= 1
+            right >>= 1
+            level += 1
+        self.counter += len(parts)
+        metrics.count('nodes_visited', len(parts))
+        if not parts:
+            return np.zeros(0, dtype=np.intp)
+        result = self.index[np.concatenate(parts)]
+        metrics.count('points_scanned', len(result))
+        metrics.count('results_emitted', len(result))
+        return result
+
+    def block_range(self, level: int, block: int, low: int, high: int) -> np.ndarray:
+        """
+        Positions in x order of the points of a block with low <= rank of y < high.
+        """
+        keys = self.keys[level]
+        base = block * self.span
+        begin, end = np.searchsorted(keys, (base + low, base + high), side='left')
+        return self.levels[level][begin:end]
+
+    def query_many(self, rects, count_only: bool = False):
+        """
+        Answer a batch of rectangles with vectorized searches: the canonical
+        block decomposition runs for all rectangles at once, level by level,
+        with one searchsorted per level. Returns an array of counts when
+        count_only, else a list with an index array per rectangle.
+        """
+        bounds = rects_bounds(rects)
+        left = np.searchsorted(self.xs, bounds[:, 0], side='left')
+        right = np.searchsorted(self.xs, bounds[:, 1], side='right')
+        low = np.searchsorted(self.y_values, bounds[:, 2], side='left')
+        high = np.searchsorted(self.y_values, bounds[:, 3], side='right')
+        right[low >= high] = 0
+        counts = np.zeros(len(bounds), dtype=np.int64)
+        parts = None if count_only else [[] for _ in range(len(bounds))]
+
+        level = 0
+        while level < len(self.keys):
+            active = left < right
+            if not active.any():
+                break
+            take = active & (left & 1 == 1)
+            self.take_blocks(level, np.flatnonzero(take), left[take], low, high, counts, parts)
+            left[take] += 1
+            take = active & (right & 1 == 1)
+            right[take] -= 1
+            self.take_blocks(level, np.flatnonzero(take), right[take], low, high, counts, parts)
+            left >>= 1
+            right >>= 1
+            level += 1
+
+        metrics.count('points_scanned', int(counts.sum()))
+        metrics.count('results_emitted', int(counts.sum()))
+        if count_only:
+            return counts
+        return [self.index[np.concatenate(part)] if part else np.zeros(0, dtype=np.intp) for part in parts]
+
+    def take_blocks(self, level: int, rects: np.ndarray, blocks: np.ndarray, low, high, counts, parts):
+        """
+        Add the points of one block per rectangle at a level to the counts,
+        and to the per rectangle parts unless only counting.
+        """
+        if not len(rects):
+            return
+        self.counter += len(rects)
+        metrics.count('nodes_visited', len(rects))
+        keys = self.keys[level]
+        base = blocks.astype(np.int64) * self.span
+        begin = np.searchsorted(keys, base + low[rects], side='left')
+        end = np.searchsorted(keys, base + high[rects], side='left')
+        counts[rects] += end - begin
+        if parts is not None:
+            order = self.levels[level]
+            for k, b, e in zip(rects.tolist(), begin.tolist(), end.tolist()):
+                if b < e:
+                    parts[k].append(order[b:e])
@@ -1,53 +1,114 @@
+"""
+Generate random points files, text or binary.
+
+Run from the repository root, which makes the Lab1 package importable:
+    python -m Lab1.data.pointGen 1000000 0 10000 --output Lab1/data/1000000points
+"""
+import argparse
 import sys
+
 import numpy as np
-from scipy.spatial import ConvexHull
+
+from Lab1.point_file import PointFileWriter
+
+DISTRIBUTIONS = ['uniform', 'clusters', 'grid', 'collinear']
+CHUNK_SIZE = 1 << 20
+
+
+def make_generator(distribution, low, high, rng):
+    """
+    Return a function giving chunks of m points of the distribution as an
+    (m, 2) int64 array, with coordinates between low and high - 1.
+      uniform   -- independent uniform coordinates
+      clusters  -- gaussian clusters around random centers
+      grid      -- a coarse lattice, so many points are duplicated
+      collinear -- points on a horizontal, a vertical and a diagonal line
+    """
+    size = high - low
+    if distribution == 'uniform':
+        return lambda m: rng.integers(low, high, size=(m, 2))
+    if distribution == 'clusters':
+        centers = rng.integers(low, high, size=(max(size // 1000, 8), 2))
+        sigma = max(size / 200, 1.0)
+
+        def clusters(m):
+            points = centers[rng.integers(len(centers), size=m)] + rng.normal(scale=sigma, size=(m, 2))
+            return np.clip(np.rint(points), low, high - 1).astype(np.int64)
+
+        return clusters
+    if distribution == 'grid':
+        step = max(size // 64, 1)
+        return lambda m: low + step * rng.integers(0, -(-size // step), size=(m, 2))
+    if distribution == 'collinear':
+        middle = low + size // 2
+
+        def collinear(m):
+            t = rng.integers(low, high, size=m)
+            line = rng.integers(3, size=m)
+            return np.column_stack((np.where(line == 1, middle, t), np.where(line == 0, middle, t)))
+
+        return collinear
+    raise ValueError('Unknown distribution ' + distribution)
+
+
+def generate_chunks(n, low, high, distribution='uniform', seed=None, chunk_size=CHUNK_SIZE):
+    """
+    Yield n points in chunks of at most chunk_size (m, 2) int64 arrays.
+    The output is reproducible for a given seed and chunk size.
+    """
+    rng = np.random.default_rng(seed)
+    generate = make_generator(distribution, low, high, rng)
+    for start in range(0, n, chunk_size):
+        yield generate(min(chunk_size, n - start))
+
+
+def write_text(outpf, chunk):
+    """
+    Write a chunk as tab separated lines, formatting all of it in one call.
+    """
+    outpf.write(('%d\t%d\n' * len(chunk)) % tuple(chunk.ravel().tolist()))
 
 
 def main():
-    try:
-        n = int(sys.argv[1])
-        low = int(sys.argv[2])
-        high = int(sys.argv[3])
-        points = np.random.randint(low, high, size=(n, 2))
-
-        print('Generated ' + str(n) + ' random (x, y) coordinates. Each coordinate between ' + str(low) + ' and ' + str(
-            high) + '.')
-        """print('Generating convex hull...')
-        hull = ConvexHull(points)
-        print('Convex hull generated!\nPrinting to output file...')"""
-
-        outputfilename = str(n) + 'points'
-        outpf = open(outputfilename, 'w')
-
-        # outpf.write(str(hull.vertices.size) + '\n')
-        # outpf.write(str(n) + '\t' + str(low) + '\t' + str(high) + '\n')
-
-        for p in points:
-            outpf.write(str(p[0]) + '\t' + str(p[1]) + '\n')
-
-        outpf.close()
-
-        print('Done! File saved as ' + outputfilename)
-        """showpoly = raw_input('Want to see how your polygon came out? (y/n): ')
-        if(showpoly == 'y'):
-            import matplotlib.pyplot as plt
-            for simplex in hull.simplices:
-                plt.plot(points[simplex, 0], points[simplex, 1], 'k-')
-            plt.show()
-        else:
-            print('We\'re ready then. Bye! :)')"""
-
-    except IndexError:
-        print('Not enough arguments. 3 arguments needed.\nUse:\n\
-        python pointsGen.py <n of points> <lower int> <higher int>')
-    except ValueError:
-        print('All arguments must be integers:\nFirst argument is number of points in mesh.\n\
-        Second and third arguments are lower and higher limits for random number in coordinates.\nUse:\n\
-        python pointsGen.py <n of points> <lower int> <higher int>')
-    except:
-        print('Unexpected error: ', sys.exc_info()[0])
-        raise
+    parser = argparse.ArgumentParser(description='Generate random (x, y) points files.')
+    parser.add_argument('n', type=int, help='number of points')
+    parser.add_argument('low', type=int, help='lower limit of the coordinates')
+    parser.add_argument('high', type=int, help='higher limit of the coordinates (excluded)')
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform')
+    parser.add_argument('--seed', type=int, default=None, help='seed for a reproducible output')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='points generated and written at once')
+    parser.add_argument('--search', type=int, nargs=4, metavar=('X0', 'Y0', 'X1', 'Y1'),
+                        help='search area corners, the middle quarter by default')
+    parser.add_argument('--binary', action='store_true', help='write the binary format')
+    parser.add_argument('--output', help='output file name, <n>points by default')
+    args = parser.parse_args()
+    if args.high <= args.low or args.n < 0 or args.chunk_size <= 0:
+        parser.error('Expected n >= 0, low < high and a positive chunk size')
+
+    quarter = (args.high - args.low) // 4
+    search = args.search or [args.low + quarter, args.low + quarter, args.high - quarter, args.high - quarter]
+    chunks = generate_chunks(args.n, args.low, args.high, args.distribution, args.seed, args.chunk_size)
+    print('Generating ' + str(args.n) + ' ' + args.distribution + ' (x, y) coordinates. Each coordinate between ' +
+          str(args.low) + ' and ' + str(args.high) + '.')
+
+    if args.binary:
+        outputfilename = args.output or str(args.n) + 'points.pts'
+        with PointFileWriter(outputfilename, [search[:2], search[2:]]) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    else:
+        outputfilename = args.output or str(args.n) + 'points'
+        with open(outputfilename, 'w') as outpf:
+            # Search area rows first, as the points readers expect them
+            outpf.write('%d %d\n%d %d\n' % tuple(search))
+            for chunk in chunks:
+                write_text(outpf, chunk)
+
+    print('Done! File saved as ' + outputfilename)
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)
@@ -0,0 +1,208 @@
+import numpy as np
+
+from instrumentation import metrics, timed
+from Lab1.array_tree import ArraySegmentTree, as_point_array, rects_bounds
+from Lab1.spatial_index import SpatialIndex
+
+# Points per cell aimed at when the cell size is chosen automatically
+POINTS_PER_CELL = 4
+# Beyond these the array tree answers queries faster, see choose_index
+GRID_MAX_RESULTS = 1000
+GRID_MAX_CROWDING = 32 * POINTS_PER_CELL
+
+
+def auto_cell_size(coords: np.ndarray, points_per_cell: int = POINTS_PER_CELL) -> np.ndarray:
+    """
+    Integer width and height of cells so the bounding box of coords holds
+    about points_per_cell points per cell on average. Each axis is split by
+    its own extent, at least once and at most once per point, so thin boxes
+    get as few cells as square ones.
+    """
+    if not len(coords):
+        return np.ones(2, dtype=np.int64)
+    width, height = (coords.max(axis=0) - coords.min(axis=0) + 1).tolist()
+    cells = max(len(coords) // points_per_cell, 1)
+    columns = min(max(round(np.sqrt(cells * width / height)), 1), cells, width)
+    rows = min(max(cells // columns, 1), height)
+    return np.array([-(-width // columns), -(-height // rows)], dtype=np.int64)
+
+
+def crowding(coords: np.ndarray, cell_size=None) -> float:
+    """
+    Mean number of distinct points in the cell of a distinct point,
+    POINTS_PER_CELL or a bit more for uniform points, much more when they
+    gather in a few cells. Duplicates are left out: they add as many
+    results as candidates to a query, so they do not slow the grid down.
+    """
+    if not len(coords):
+        return 0.0
+    cell_size = auto_cell_size(coords) if cell_size is None else cell_size
+    coords = np.unique(coords, axis=0)
+    cells = (coords - coords.min(axis=0)) // cell_size
+    _, occupancy = np.unique(cells[:, 0] * (int(cells[:, 1].max()) + 1) + cells[:, 1], return_counts=True)
+    return float(np.dot(occupancy, occupancy)) / len(coords)
+
+
+def choose_index(points, selectivity: float) -> type:
+    """
+    Engine expected to answer fastest rectangles holding about the
+    selectivity fraction of the points: the grid when they hold at most
+    GRID_MAX_RESULTS points and the crowding of the points is at most
+    GRID_MAX_CROWDING, the array tree otherwise.
+    """
+    coords = as_point_array(points)
+    if selectivity * len(coords) <= GRID_MAX_RESULTS and crowding(coords) <= GRID_MAX_CROWDING:
+        return GridIndex
+    return ArraySegmentTree
+
+
+class GridIndex(SpatialIndex):
+    """
+    Uniform grid spatial hash of points kept in NumPy arrays.
+
+    Points are bucketed in rectangular cells and sorted by cell, numbering
+    the cells column by column, so the cells of a rectangle in one column of
+    the grid are a contiguous range of points. Queries gather these ranges
+    for all their columns at once: cells inside a rectangle are taken
+    whole, only the points of its border cells are compared with it. Best
+    for small rectangles over roughly uniform data, where the number of
+    candidates stays close to the number of results. Queries return indices
+    in the input points, as ArraySegmentTree does.
+    """
+    __slots__ = ['index', 'xs', 'ys', 'origin', 'cell_size', 'columns', 'rows', 'starts',
+                 'x_cords', 'y_cords', 'result', 'counter']
+
+    @timed('build')
+    def __init__(self, points, search_area=None, cell_size=None):
+        coords = as_point_array(points)
+        # Width and height of the cells, a single size makes square cells
+        if cell_size is None:
+            self.cell_size = auto_cell_size(coords)
+        else:
+            self.cell_size = np.broadcast_to(np.asarray(cell_size, dtype=np.int64), 2).copy()
+        self.origin = coords.min(axis=0) if len(coords) else np.zeros(2, dtype=np.int64)
+        cells = (coords - self.origin) // self.cell_size
+        self.columns = int(cells[:, 0].max()) + 1 if len(coords) else 1
+        self.rows = int(cells[:, 1].max()) + 1 if len(coords) else 1
+        cell = cells[:, 0] * self.rows + cells[:, 1]
+        # Input indices in cell order, and where each cell starts in it
+        self.index = np.argsort(cell, kind='stable')
+        self.xs = coords[self.index, 0]
+        self.ys = coords[self.index, 1]
+        self.starts = np.zeros(self.columns * self.rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell, minlength=self.columns * self.rows), out=self.starts[1:])
+
+        # Default search area used by query() without arguments
+        self.x_cords = self.y_cords = None
+        if search_area is not None:
+            x_min, x_max, y_min, y_max = rects_bounds([search_area])[0].tolist()
+            self.x_cords = (x_min, x_max)
+            self.y_cords = (y_min, y_max)
+        self.result = np.zeros(0, dtype=np.intp)
+        self.counter = 0
+
+    @timed('query')
+    def query(self, rect=None) -> np.ndarray:
+        """
+        Indices of the points inside rect, given by two corners, or inside
+        the search area of the index when rect is None, in which case they
+        are also kept in self.result.
+        """
+        if rect is not None:
+            return self.query_many([rect])[0]
+        self.result = self.query_many([((self.x_cords[0], self.y_cords[0]), (self.x_cords[1], self.y_cords[1]))])[0]
+        return self.result
+
+    def count(self, rect) -> int:
+        """
+        Number of points inside rect.
+        """
+        return int(self.query_many([rect], count_only=True)[0])
+
+    def query_many(self, rects, count_only: bool = False):
+        """
+        Answer a batch of rectangles with vectorized gathers over all of
+        them at once. Returns an array of counts when count_only, else a
+        list with an index array per rectangle.
+        """
+        bounds = rects_bounds(rects)
+        (positions, owners), (begin, lengths, inner) = self.gather(bounds)
+        border = np.bincount(owners, minlength=len(bounds))
+        whole = np.bincount(inner, weights=lengths, minlength=len(bounds)).astype(np.int64)
+        counts = border + whole
+        if count_only:
+            return counts
+        if not len(bounds):
+            return []
+        # Each rectangle gets its border points, then its inner ranges
+        offsets = np.cumsum(counts) - counts
+        result = np.empty(int(counts.sum()), dtype=np.intp)
+        result[ranks(owners, offsets - (np.cumsum(border) - border))] = self.index[positions]
+        inner = np.repeat(inner, lengths)
+        result[ranks(inner, offsets + border - (np.cumsum(whole) - whole))] = self.index[ranges(begin, lengths)]
+        return np.split(result, np.cumsum(counts)[:-1])
+
+    def gather(self, bounds: np.ndarray):
+        """
+        Points inside (M, 4) bounds x_min, x_max, y_min, y_max, in two
+        parts grouped by rectangle. Cells on the border of a rectangle are
+        filtered: the positions in cell order of their points inside it and
+        its row in bounds. Cells inside it are taken whole, as ranges of
+        points: their begin positions, lengths and rows in bounds. The
+        cells of a rectangle in one column are consecutive ranges of points.
+        """
+        width, height = self.cell_size.tolist()
+        col_low = np.maximum((bounds[:, 0] - self.origin[0]) // width, 0)
+        col_high = np.minimum((bounds[:, 1] - self.origin[0]) // width, self.columns - 1)
+        row_low = np.maximum((bounds[:, 2] - self.origin[1]) // height, 0)
+        row_high = np.minimum((bounds[:, 3] - self.origin[1]) // height, self.rows - 1)
+        widths = np.where(row_low <= row_high, np.maximum(col_high - col_low + 1, 0), 0)
+
+        # One item per (rectangle, column) pair
+        owners = np.repeat(np.arange(len(bounds)), widths)
+        columns = ranges(col_low, widths)
+        edge = (columns == col_low[owners]) | (columns == col_high[owners])
+        base = columns * self.rows
+        low = base + row_low[owners]
+        high = base + row_high[owners]
+        self.counter += len(columns)
+        metrics.count('nodes_visited', len(columns))
+
+        # Whole edge columns, and the bottom and top cells of the others
+        inner = ~edge
+        top = inner & (high > low)
+        cell_begin = np.concatenate((low[edge], low[inner], high[top]))
+        cell_end = np.concatenate((high[edge], low[inner], high[top])) + 1
+        cell_owners = np.concatenate((owners[edge], owners[inner], owners[top]))
+        order = np.argsort(cell_owners, kind='stable')
+        begin = self.starts[cell_begin[order]]
+        lengths = self.starts[cell_end[order]] - begin
+        positions = ranges(begin, lengths)
+        cell_owners = np.repeat(cell_owners[order], lengths)
+        metrics.count('points_scanned', len(positions))
+        xs = self.xs[positions]
+        ys = self.ys[positions]
+        inside = ((xs >= bounds[cell_owners, 0]) & (xs <= bounds[cell_owners, 1]) &
+                  (ys >= bounds[cell_owners, 2]) & (ys <= bounds[cell_owners, 3]))
+        border = positions[inside], cell_owners[inside]
+
+        # Cells strictly inside the rectangles
+        inner_begin = self.starts[low[inner] + 1]
+        inner_lengths = np.maximum(self.starts[high[inner]] - inner_begin, 0)
+        metrics.count('results_emitted', len(border[0]) + int(inner_lengths.sum()))
+        return border, (inner_begin, inner_lengths, owners[inner])
+
+
+def ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Concatenation of the ranges starts[i]:starts[i] + lengths[i].
+    """
+    shift = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return shift + np.arange(len(shift), dtype=np.int64)
+
+
+def ranks(groups: np.ndarray, shifts: np.ndarray) -> np.ndarray:
+    """
+    Position i of sorted groups moved by the shift of its group.
+    """
+    return np.arange(len(groups), dtype=np.int64) + shifts[groups]
@@ -1,46 +1,110 @@
-import math
-from time import time
+"""
+Range search over points with a segment tree, Lab 1.
+
+Run from the repository root, which makes the instrumentation module and
+the Lab1 package importable:
+    python -m Lab1.main [points file]
+The points file defaults to Lab1/data/1000000points, written by
+    python -m Lab1.data.pointGen 1000000 0 10000 --output Lab1/data/1000000points
+"""
+import gc
+import mmap
+import os
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from itertools import accumulate, chain, groupby, islice
+from operator import attrgetter
+
+import numpy as np
+
+from instrumentation import metrics, timed
+from Lab1.spatial_index import SpatialIndex
+
+# Points files and exports of the lab
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# Bytes of a points file parsed at once
+CHUNK_SIZE = 1 << 24
+# Point count above which plot_points draws histograms instead of markers
+RASTER_ABOVE = 100000
+# Structured dtype of points, the NumPy alternative to lists of Point
+POINT_DTYPE = np.dtype([('x', np.int64), ('y', np.int64)])
+
+
+@timed('load')
+def read_data_from_file(filepath: str):
+    """
+    Getting data with a list of points, as well as
+    search points - points that define the search area
 
-from matplotlib import patches, pyplot as plt
+    :param filepath: path to data file
+    :return: Tuple of: points list and search list
+    """
+    points, search = load_points(filepath)
+    points_list = list(map(Point, points[:, 0].tolist(), points[:, 1].tolist()))
+    search_list = list(map(Point, search[:, 0].tolist(), search[:, 1].tolist()))
+    return points_list, search_list
 
 
-def performance(func):
-    def wrapper(*args, **kwargs):
-        t1 = time()
-        result = func(*args, **kwargs)
-        t2 = time()
-        print(f'Function: {func} took {t2 - t1} s')
-        return result
+@timed('load')
+def load_points(filepath: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Load a whole points file into NumPy arrays
 
-    return wrapper
+    :param filepath: path to data file
+    :param chunk_size: bytes parsed at once
+    :return: Tuple of: (N, 2) int64 points and (2, 2) int64 search area
+    """
+    search, chunks = stream_points(filepath, chunk_size)
+    chunks = list(chunks)
+    points = np.concatenate(chunks) if chunks else np.zeros((0, 2), dtype=np.int64)
+    return points, search
 
 
-@performance
-def read_data_from_file(filepath: str):
+def stream_points(filepath: str, chunk_size: int = CHUNK_SIZE):
     """
-    Getting data with a list of points, as well as
-    search points - points that define the search area
+    Stream a points file that may not fit in memory: the two search rows
+    are read first, the points follow as a generator of (n, 2) int64 arrays.
 
     :param filepath: path to data file
-    :return: Tuple of: points list and search list
+    :param chunk_size: bytes parsed at once
+    :return: Tuple of: (2, 2) int64 search area and iterator of point chunks
+    """
+    rows = iter_rows(filepath, chunk_size)
+    search = np.zeros((0, 2), dtype=np.int64)
+    for chunk in rows:
+        need = 2 - len(search)
+        search = np.concatenate((search, chunk[:need]))
+        if len(chunk) > need:
+            return search, chain([chunk[need:]], rows)
+        if len(search) == 2:
+            break
+    if len(search) < 2:
+        raise ValueError(f'{filepath} does not have the two search area rows')
+    return search, rows
+
+
+def iter_rows(filepath: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Memory map a points file and parse it chunk by chunk, each chunk
+    ending at a line end. Lines starting with # are skipped, only the first
+    two columns of each line are kept. Yields (n, 2) int64 arrays.
     """
     try:
-        with open(filepath, mode='r+') as data_file:
-            points_quantity, counter = -1, 0
-            points_list = []
-            search_list = []
-            for line in data_file:
-                if not line.startswith("#"):
-                    if counter < 2:
-                        value_list = list(map(int, line.split()))
-                        search_list.append(Point(value_list[0], value_list[1]))
-                        counter += 1
-                        continue
-                    value_list = list(map(int, line.split()))
-                    points_list.append(Point(value_list[0], value_list[1]))
-                    points_quantity += 1
-
-            return points_list, search_list
+        with open(filepath, mode='rb') as data_file:
+            if os.fstat(data_file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                begin = 0
+                while begin < len(data):
+                    end = data.rfind(b'\n', begin, begin + chunk_size) + 1
+                    if end <= begin or begin + chunk_size >= len(data):
+                        end = data.find(b'\n', begin + chunk_size) + 1 or len(data)
+                    rows = parse_rows(data[begin:end])
+                    begin = end
+                    if len(rows):
+                        yield rows
     except FileNotFoundError as err:
         print('File do not exist')
         raise err
@@ -49,10 +113,47 @@ def read_data_from_file(filepath: str):
         raise err
 
 
+def parse_rows(text: bytes) -> np.ndarray:
+    """
+    Parse whole lines of whitespace separated integers into an (n, 2) array
+    of the first two values of each line.
+    """
+    if text.startswith(b'#') or b'\n#' in text or b'\n\n' in text or text.startswith(b'\n'):
+        text = b'\n'.join(line for line in text.split(b'\n') if line.strip() and not line.startswith(b'#'))
+    lines = text.count(b'\n') + (not text.endswith(b'\n'))
+    if not text.strip():
+        return np.zeros((0, 2), dtype=np.int64)
+    try:
+        values = np.fromstring(text, dtype=np.int64, sep=' ')
+    except ValueError:
+        # Bad values, the line by line parse reports them
+        values = None
+    if values is not None and len(values) % lines == 0 and (tokens_per_line(text, lines) == len(values) // lines).all():
+        return values.reshape(lines, -1)[:, :2]
+    # Lines of different lengths or bad values, go line by line
+    rows = [line.split()[:2] for line in text.splitlines() if line.strip()]
+    for row in rows:
+        if len(row) < 2:
+            raise ValueError(f'Expected two values per line, got {b" ".join(row)!r}')
+    return np.array(rows, dtype=np.int64)
+
+
+def tokens_per_line(text: bytes, lines: int) -> np.ndarray:
+    """
+    Number of whitespace separated values on each of the lines of text.
+    """
+    data = np.frombuffer(text, dtype=np.uint8)
+    # Values are digits and signs, anything up to the space byte separates them
+    space = data <= 32
+    starts = np.flatnonzero(~space & np.concatenate(([True], space[:-1])))
+    return np.bincount(np.searchsorted(np.flatnonzero(data == 10), starts), minlength=lines)[:lines]
+
+
 class Point:
     """
     Default class of points with all interrelation
-    operations for x and y, separately and for both
+    operations for x and y, separately and for both.
+    Points are ordered by x, then by y, as (x, y) tuples are.
     """
     __slots__ = ['x', 'y']
 
@@ -64,20 +165,24 @@ class Point:
         return self.x == other.x and self.y == other.y
 
     def __gt__(self, other):
-        return self.x > other.x and self.y > other.y
+        return (self.x, self.y) > (other.x, other.y)
 
     def __ge__(self, other):
-        return self.x >= other.x and self.y > other.y
+        return (self.x, self.y) >= (other.x, other.y)
 
     def __lt__(self, other):
-        return not (self.__gt__(other))
+        return (self.x, self.y) < (other.x, other.y)
 
     def __le__(self, other):
-        return not (self.__ge__(other))
+        return (self.x, self.y) <= (other.x, other.y)
 
     def __ne__(self, other):
         return not (self.__eq__(other))
 
+    def __iter__(self):
+        yield self.x
+        yield self.y
+
     def __str__(self):
         return "(%d,%d)" % (self.x, self.y)
 
@@ -85,16 +190,39 @@ class Point:
         return "(%d,%d)" % (self.x, self.y)
 
     def __hash__(self):
-        return hash(str(self))
+        return hash((self.x, self.y))
+
+
+def to_records(points) -> np.ndarray:
+    """
+    Points as a structured array of POINT_DTYPE, from a list of Point or an
+    (N, 2) array. Records compare, sort and np.unique by (x, y) like Point.
+    """
+    coords = np.ascontiguousarray(point_coords(points), dtype=np.int64)
+    return coords.view(POINT_DTYPE).ravel()
+
+
+def from_records(records: np.ndarray) -> list:
+    """
+    List of Point from a structured array of POINT_DTYPE.
+    """
+    return list(map(Point, records['x'].tolist(), records['y'].tolist()))
 
 
 class NodeData:
-    __slots__ = ['left_index', 'right_index', 'sorted_y']
+    """
+    Node of the range tree: x range [left_index; right_index) and the
+    points under it sorted by y. left_bridge[i] is how many of the first
+    i points of sorted_y belong to the left child, the rest belong to the
+    right one (fractional cascading), it is None for leaves.
+    """
+    __slots__ = ['left_index', 'right_index', 'sorted_y', 'left_bridge']
 
-    def __init__(self, left: int, right: int, sorted_y: list):
+    def __init__(self, left: int, right: int, sorted_y: list, left_bridge: array = None):
         self.left_index = left
         self.right_index = right
         self.sorted_y = sorted_y
+        self.left_bridge = left_bridge
 
     def __repr__(self):
         return f"[{self.left_index}; {self.right_index}), {self.sorted_y}"
@@ -111,36 +239,96 @@ class Node:
     def __repr__(self):
         return f"{self.data}"
 
-    def graph_viz(self, string_mutable):
-        if self is None:
-            return
+    def graph_viz(self, out, max_depth: int = None, max_points: int = 3) -> int:
+        """
+        Stream the subtree as DOT nodes and edges to the file object out,
+        iteratively, with short node IDs and labels holding the x range, the
+        number of points and at most max_points of them. Nodes at max_depth
+        are drawn dashed when they have children left out.
+        Returns the number of nodes written.
+        """
+        count = 1
+        stack = [(self, 0, 0)]
+        while stack:
+            node, name, depth = stack.pop()
+            data = node.data
+            shown = ', '.join(map(str, islice(data.sorted_y, max_points)))
+            more = ', ...' if len(data.sorted_y) > max_points else ''
+            cut = max_depth is not None and depth >= max_depth and (node.left is not None or node.right is not None)
+            style = ', style = dashed' if cut else ''
+            out.write(f'n{name} [label = "[{data.left_index}; {data.right_index})\\n{len(data.sorted_y)} points'
+                      f'\\n{shown}{more}"{style}]\n')
+            if cut:
+                continue
+            for child, label in ((node.right, 'right'), (node.left, 'left')):
+                if child is not None:
+                    out.write(f'n{name} -> n{count} [label = "{label}"]\n')
+                    stack.append((child, count, depth + 1))
+                    count += 1
+        return count
+
+
+def rect_bounds(rect):
+    """
+    Bounds x_min, x_max, y_min, y_max, all inclusive, of a rectangle given
+    by two opposite corners, each a Point or an (x, y) pair.
+    """
+    (ax, ay), (bx, by) = ((corner.x, corner.y) if isinstance(corner, Point) else corner for corner in rect)
+    return min(ax, bx), max(ax, bx), min(ay, by), max(ay, by)
 
-        string_mutable[0] += f"\"{self}\"\n"
 
-        if self.left is not None:
-            string_mutable[0] += f"\"{self}\" -> \"{self.left}\" [label = \"left\"]\n"
-        if self.right is not None:
-            string_mutable[0] += f"\"{self}\" -> \"{self.right}\" [label = \"right\"]\n"
+def point_coords(points) -> np.ndarray:
+    """
+    Coordinates of a list of Point, an (N, 2) array or POINT_DTYPE records
+    as an (N, 2) array.
+    """
+    if isinstance(points, np.ndarray):
+        if points.dtype.names:
+            return np.column_stack((points['x'], points['y']))
+        return points.reshape(-1, 2)
+    xs = np.fromiter(map(attrgetter('x'), points), dtype=np.int64, count=len(points))
+    ys = np.fromiter(map(attrgetter('y'), points), dtype=np.int64, count=len(points))
+    return np.column_stack((xs, ys))
 
-        if self.left is not None:
-            self.left.graph_viz(string_mutable)
 
-        if self.right is not None:
-            self.right.graph_viz(string_mutable)
+def hit_mask(coords: np.ndarray, res_points) -> np.ndarray:
+    """
+    Mask of the coords found by a query: res_points is a set of Point, as
+    SegmentTree.query returns, or an index array, as ArraySegmentTree.query
+    returns.
+    """
+    if isinstance(res_points, np.ndarray):
+        hit = np.zeros(len(coords), dtype=bool)
+        hit[res_points] = True
+        return hit
+    return np.isin(to_records(coords), to_records(list(res_points)))
+
+
+@contextmanager
+def paused_gc():
+    """
+    Pause the cyclic garbage collector while building: the build creates
+    millions of acyclic lists and nodes, and every collection would walk
+    all of them again.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
 
 
 def make_clusters(sorted_list):
-    result_list = []
-    temp_list = []
-    for item in sorted_list:
-        if len(temp_list) == 0 or temp_list[-1].x == item.x:
-            temp_list.append(item)
-        else:
-            result_list.append(sorted(temp_list.copy(), key=lambda point: point.y))
-            temp_list.clear()
-            temp_list.append(item)
-    if len(temp_list) != 0:
-        result_list.append(temp_list)
+    """
+    Group points sorted by x into clusters of equal x, each one
+    sorted in place by y.
+    """
+    result_list = [list(group) for _, group in groupby(sorted_list, key=attrgetter('x'))]
+    by_y = attrgetter('y')
+    for cluster in result_list:
+        cluster.sort(key=by_y)
     return result_list
 
 
@@ -149,133 +337,190 @@ def get_cluster_x(cluster):
     return val.x
 
 
-def get_cluster_y(cluster):
-    val = cluster[0]
-    return val.y
-
-
-class SegmentTree:
+class SegmentTree(SpatialIndex):
     """
-    Build segment tree of given points of type Point.
+    Build segment tree of given points of type Point, with integer
+    coordinates: the search area bounds and root_y rely on them.
     """
-    __slots__ = ['root', 'x_cords', 'y_cords', 'result', 'counter']
-
-    @performance
-    def __init__(self, points_list: list, search_area: list):
-        points_list = make_clusters(sorted(point_list, key=lambda point: point.x))
-        self.root = self.build_tree(points_list, get_cluster_x(points_list[0]), get_cluster_x(points_list[-1]))
-        self.x_cords = (min(search_area[0].x, search_area[1].x), max(search_area[0].x, search_area[1].x))
-        self.x_cords = (self.x_cords[0], self.x_cords[1] + 1)
-        self.y_cords = (min(search_area[0].y, search_area[1].y), max(search_area[0].y, search_area[1].y))
+    __slots__ = ['root', 'root_y', 'x_cords', 'y_cords', 'result', 'counter']
+
+    @timed('build')
+    def __init__(self, points_list: list, search_area: list = None):
+        if isinstance(points_list, np.ndarray):
+            if points_list.dtype.kind not in 'iu':
+                raise ValueError(f'Points must have integer coordinates, got {points_list.dtype}')
+            points_list = list(map(Point, points_list[:, 0].tolist(), points_list[:, 1].tolist()))
+        clusters = make_clusters(sorted(points_list, key=attrgetter('x')))
+        with paused_gc():
+            self.root = self.build_tree(clusters, 0, len(clusters))
+        # y of the root points, the only list that needs a binary search
+        self.root_y = array('q', map(attrgetter('y'), self.root.data.sorted_y))
+        # Default search area used by query() without arguments
+        self.x_cords = self.y_cords = None
+        if search_area is not None:
+            x_min, x_max, y_min, y_max = rect_bounds(search_area)
+            self.x_cords = (x_min, x_max + 1)
+            self.y_cords = (y_min, y_max)
         self.result = set()
         self.counter = 0
 
-    def build_tree(self, points_list: list, left_index, right_index) -> Node:
-        if len(points_list) == 1:
-            return Node(NodeData(get_cluster_x(points_list[0]), get_cluster_x(points_list[-1]) + 1, points_list), None,
-                        None)
-        median = math.floor((1 + len(points_list)) / 2)
-        left_list = points_list[:median]
-        left = self.build_tree(left_list, get_cluster_x(points_list[0]), get_cluster_x(points_list[-1]))
-        median = math.floor((1 + len(points_list)) / 2)
-        right_list = points_list[median:]
-        right = self.build_tree(right_list, get_cluster_x(points_list[0]), get_cluster_x(points_list[-1]))
-        return Node(
-            NodeData(get_cluster_x(points_list[0]), get_cluster_x(points_list[-1]) + 1, self.sort_by_y(points_list)),
-            left, right)
-
-    @staticmethod
-    def sort_by_y(to_sort: list):
-        return sorted(to_sort, key=lambda points: get_cluster_y(points))
-
-    @performance
-    def query(self):
-        search_root = self.root
-        if search_root is None:
-            return
-
-        if search_root.left is None or search_root.right is None:
-            self.check_segment_node(search_root)
-            return
-
-        while search_root.right.data.left_index >= self.x_cords[1]:
-            search_root = search_root.left
-            if search_root.right is None:
-                self.check_segment_node(search_root)
-                return
-
-        while search_root.left.data.right_index <= self.x_cords[0]:
-            search_root = search_root.right
-            if search_root.left is None:
-                self.check_segment_node(search_root)
-                return
+    def build_tree(self, clusters: list, begin: int, end: int) -> Node:
+        """
+        Build the subtree over clusters[begin:end] in O(n log n).
+        """
+        points = list(chain.from_iterable(clusters[begin:end]))
+        points_y = list(map(attrgetter('y'), points))
+        starts = list(accumulate(map(len, clusters[begin:end]), initial=0))
+        return self.build_node(clusters[begin:end], starts, points, points_y, 0, end - begin)[0]
+
+    def build_node(self, clusters: list, starts: list, points: list, points_y: list, begin: int, end: int):
+        """
+        Build the subtree over clusters[begin:end] working on index ranges,
+        points is the concatenation of the clusters and starts the offset of
+        each cluster in it. The y order of the children, as indices in points,
+        is merged bottom-up as merge sort does: timsort finds both runs and
+        merges them in linear time. Returns the node and its y order.
+        """
+        left_index = get_cluster_x(clusters[begin])
+        right_index = get_cluster_x(clusters[end - 1]) + 1
+        if end - begin == 1:
+            return Node(NodeData(left_index, right_index, clusters[begin]), None, None), \
+                list(range(starts[begin], starts[end]))
+        median = begin + (end - begin + 1) // 2
+        left, left_order = self.build_node(clusters, starts, points, points_y, begin, median)
+        right, right_order = self.build_node(clusters, starts, points, points_y, median, end)
+        order = sorted(left_order + right_order, key=points_y.__getitem__)
+        sorted_y = list(map(points.__getitem__, order))
+        left_bridge = array('i', accumulate(map(starts[median].__gt__, order), initial=0))
+        return Node(NodeData(left_index, right_index, sorted_y, left_bridge), left, right), order
+
+    @timed('query')
+    def query(self, rect=None) -> set:
+        """
+        Points inside rect, given by two corners, or inside the search area
+        of the tree when rect is None, in which case they are also kept in
+        self.result. The y range is searched once in the root, and followed
+        down the tree through the bridges, so a query costs O(log n + k).
+        """
+        if rect is not None:
+            return self.query_many([rect])[0]
+        result = self.query_many([((self.x_cords[0], self.y_cords[0]), (self.x_cords[1] - 1, self.y_cords[1]))])[0]
+        self.result = result
+        return result
 
-        self.query_left(search_root.left)
-        self.query_right(search_root.right)
-
-    def query_left(self, left_node: Node):
-        if left_node is None:
-            return
-        if left_node.right is None:
-            self.check_segment_node(left_node)
-        if self.check_segment_node(left_node.right):
-            self.query_left(left_node.left)
-        if self.check_segment_node(left_node.left):
-            self.query_left(left_node.right)
-
-    def query_right(self, right_node: Node):
-        if right_node is None:
-            return
-        if right_node.left is None:
-            self.check_segment_node(right_node)
-        if self.check_segment_node(right_node.left):
-            self.query_right(right_node.right)
-        if self.check_segment_node(right_node.right):
-            self.query_right(right_node.left)
-
-    @staticmethod
-    def check_axis_y(to_check_y, down, up) -> bool:
-        return down <= to_check_y <= up
-
-    def check_segment_node(self, node: Node):
-        # Add nested segments
-        res = True
-        self.counter += 1
-        if node is None or (self.x_cords[0] > node.data.right_index or self.x_cords[1] < node.data.left_index):
-            return res
-
-        if self.x_cords[0] <= node.data.left_index:
-            res = True
-            if self.x_cords[1] >= node.data.right_index:
-                for item in node.data.sorted_y:
-                    for cluster in item:
-                        if self.check_axis_y(cluster.y, self.y_cords[0], self.y_cords[1]):
-                            self.result.add(cluster)
-
-        return res
-
-    def graph_viz(self):
-        string = "digraph g {\n"
-        wrapper = [string]
-
-        self.root.graph_viz(wrapper)
-        wrapper[0] += "}\n"
-
-        with open("data/graph_viz.txt", mode='w+') as data_file:
-            data_file.write(wrapper[0])
-
-    @performance
-    def plot_points(self, figure, axes, points, res_points, search_reg):
-        for index, point in enumerate(points):
-            if point in res_points:
-                axes.scatter([point.x], [point.y], color="green")
-            else:
-                if search_reg[0].x <= point.x <= search_reg[1].x:
-                    if search_reg[0].y <= point.y <= search_reg[1].y:
-                        print(f"Missed point: {point}")
-                axes.scatter([point.x], [point.y], color="red")
+    def count(self, rect) -> int:
+        """
+        Number of points inside rect, duplicated points included, without
+        building the result set.
+        """
+        return self.query_many([rect], count_only=True)[0]
+
+    def query_many(self, rects, count_only: bool = False) -> list:
+        """
+        Answer a batch of rectangles in one pass over the tree. Every node is
+        visited once with the rectangles still active in it, the ones whose
+        x range only partially covers the node, each with its y positions.
+        Returns a set of points, or a count when count_only, per rectangle.
+        """
+        bounds = [rect_bounds(rect) for rect in rects]
+        results = [0 if count_only else set() for _ in bounds]
+        active = []
+        for k, (_, _, y_min, y_max) in enumerate(bounds):
+            low = bisect_left(self.root_y, y_min)
+            high = bisect_right(self.root_y, y_max)
+            if low < high:
+                active.append((k, low, high))
+
+        stack = [(self.root, active)] if active else []
+        visited = scanned = 0
+        while stack:
+            node, active = stack.pop()
+            visited += 1
+            data = node.data
+            left_active, right_active = [], []
+            for k, low, high in active:
+                x_min, x_max = bounds[k][0], bounds[k][1] + 1
+                if x_min >= data.right_index or x_max <= data.left_index:
+                    continue
+                if x_min <= data.left_index and data.right_index <= x_max:
+                    scanned += high - low
+                    if count_only:
+                        results[k] += high - low
+                    else:
+                        results[k].update(data.sorted_y[low:high])
+                    continue
+                left_low, left_high = data.left_bridge[low], data.left_bridge[high]
+                if left_low < left_high:
+                    left_active.append((k, left_low, left_high))
+                if low - left_low < high - left_high:
+                    right_active.append((k, low - left_low, high - left_high))
+            if left_active:
+                stack.append((node.left, left_active))
+            if right_active:
+                stack.append((node.right, right_active))
+        self.counter += visited
+        metrics.count('nodes_visited', visited)
+        metrics.count('points_scanned', scanned)
+        metrics.count('results_emitted', sum(results) if count_only else sum(map(len, results)))
+        return results
+
+    def graph_viz(self, out=None, max_depth: int = None, subtree: str = '', max_points: int = 3):
+        """
+        Export the tree in DOT format to out, a file path or an open text
+        file, data/graph_viz.txt of the lab by default, streaming it so big
+        trees do not have to fit in a string.
+        max_depth -- Optional depth below which nodes are left out.
+        subtree -- Path from the root to the exported subtree, as a string
+        of 'l' and 'r' moves.
+        Returns the number of nodes written.
+        """
+        out = out or os.path.join(DATA_DIR, 'graph_viz.txt')
+        node = self.root
+        for move in subtree:
+            node = node.left if move == 'l' else node.right if move == 'r' else None
+            if node is None:
+                raise ValueError(f'No subtree at {subtree!r}')
+        if isinstance(out, str):
+            with open(out, mode='w') as data_file:
+                return self.graph_viz(data_file, max_depth, subtree, max_points)
+        out.write('digraph g {\n')
+        count = node.graph_viz(out, max_depth, max_points)
+        out.write('}\n')
+        return count
+
+    @timed('plot')
+    def plot_points(self, figure, axes, points, res_points, search_reg, raster_above: int = RASTER_ABOVE):
+        """
+        Plot found points in green and the others in red, with one scatter
+        call for each. Above raster_above points both sets are drawn as 2D
+        histograms instead. The result is checked against a brute force
+        search of search_reg, returns the numbers of missed and wrongly
+        found points.
+        """
+        coords = point_coords(points)
+        hit = hit_mask(coords, res_points)
+        x_min, x_max, y_min, y_max = rect_bounds(search_reg)
+        inside = (coords[:, 0] >= x_min) & (coords[:, 0] <= x_max) & (coords[:, 1] >= y_min) & (coords[:, 1] <= y_max)
+        missed = int(np.count_nonzero(inside & ~hit))
+        wrong = int(np.count_nonzero(hit & ~inside))
+        if missed or wrong:
+            print(f"Missed points: {missed}, wrongly found points: {wrong}")
+
+        if len(coords) > raster_above:
+            bins = int(min(max(np.sqrt(len(coords)) / 4, 64), 1024))
+            ranges = [[coords[:, 0].min(), coords[:, 0].max() + 1], [coords[:, 1].min(), coords[:, 1].max() + 1]]
+            for mask, cmap in ((~hit, 'Reds'), (hit, 'Greens')):
+                if mask.any():
+                    axes.hist2d(coords[mask, 0], coords[mask, 1], bins=bins, range=ranges, cmap=cmap, cmin=1)
+        else:
+            axes.scatter(coords[~hit, 0], coords[~hit, 1], color="red")
+            axes.scatter(coords[hit, 0], coords[hit, 1], color="green")
+        return missed, wrong
 
     def plot_region(self, axes, search_region):
+        # Imported here so the engines load without matplotlib
+        from matplotlib import patches
+
         width = search_region[1].x - search_region[0].x
         height = search_region[1].y - search_region[0].y
 
@@ -285,14 +530,16 @@ class SegmentTree:
 
 
 if __name__ == "__main__":
-    point_list, search_list = read_data_from_file("data/1000000points")
+    point_list, search_list = read_data_from_file(sys.argv[1] if len(sys.argv) > 1 else
+                                                  os.path.join(DATA_DIR, '1000000points'))
     tree = SegmentTree(point_list, search_list)
     tree.query()
     # print(f"Result(Points): {tree.result}")
     print(f"Result(Size): {len(tree.result)}")
     # tree.graph_viz()
 
+    # from matplotlib import pyplot as plt
     # figure, axes = plt.subplots(nrows=1, ncols=1, figsize=(10, 10))
-    # tree.plot_points(figure, axes, sorted(point_list, key=lambda point: point.x), tree.result, search_list)
+    # tree.plot_points(figure, axes, point_list, tree.result, search_list)
     # tree.plot_region(axes, search_list)
     # plt.show()
@@ -0,0 +1,144 @@
+"""
+Binary points files: a fixed header followed by the packed coordinates.
+
+Header, little endian, 80 bytes:
+    magic   4s   b'PNTS'
+    version H    FORMAT_VERSION
+    dtype   B    b'i' for int32 or b'd' for float64 coordinates
+    pad     x
+    count   Q    number of points
+    bounds  4d   x_min, y_min, x_max, y_max of the points
+    search  4d   x0, y0, x1, y1 corners of the search area
+then count rows of (x, y) in the given dtype.
+
+The range search engines (SegmentTree, ArraySegmentTree, GridIndex) only
+take int32 files, they reject float64 coordinates with a ValueError rather
+than truncating them. Float64 files are for the Delaunay triangulation.
+
+Convert text points files with:
+    python -m Lab1.point_file Lab1/data/10000points
+"""
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b'PNTS'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHBxQ4d4d')
+DTYPES = {b'i'[0]: np.dtype('<i4'), b'd'[0]: np.dtype('<f8')}
+INT32 = np.iinfo(np.int32)
+
+
+class PointFileWriter:
+    """
+    Write a binary points file chunk by chunk. Count and bounds are only
+    known at the end, so the header is written again when closing.
+    """
+
+    def __init__(self, filepath: str, search_area, integer: bool = True):
+        self.dtype = DTYPES[b'i'[0]] if integer else DTYPES[b'd'[0]]
+        self.search = np.asarray(search_area, dtype=np.float64).reshape(2, 2)
+        self.count = 0
+        self.low = np.full(2, np.inf)
+        self.high = np.full(2, -np.inf)
+        self.file = open(filepath, mode='wb')
+        self.file.write(self.header())
+
+    def header(self) -> bytes:
+        bounds = np.concatenate((self.low, self.high)) if self.count else np.zeros(4)
+        code = b'i'[0] if self.dtype.kind == 'i' else b'd'[0]
+        return HEADER.pack(MAGIC, FORMAT_VERSION, code, self.count, *bounds.tolist(), *self.search.ravel().tolist())
+
+    def write(self, points):
+        """
+        Append an (n, 2) array of points.
+        """
+        points = np.asarray(points).reshape(-1, 2)
+        if not len(points):
+            return
+        if self.dtype.kind == 'i' and (points.min() < INT32.min or points.max() > INT32.max):
+            raise ValueError('Coordinates do not fit in int32, write the file with integer=False')
+        self.low = np.minimum(self.low, points.min(axis=0))
+        self.high = np.maximum(self.high, points.max(axis=0))
+        self.count += len(points)
+        self.file.write(np.ascontiguousarray(points, dtype=self.dtype).tobytes())
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.seek(0)
+        self.file.write(self.header())
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_points_binary(filepath: str, points, search_area):
+    """
+    Write an (N, 2) array of points and its search area as a binary file,
+    int32 when the points are integers, float64 otherwise.
+    """
+    points = np.asarray(points).reshape(-1, 2)
+    with PointFileWriter(filepath, search_area, integer=points.dtype.kind in 'iub') as writer:
+        writer.write(points)
+
+
+def read_header(filepath: str) -> dict:
+    """
+    Parse and validate the header of a binary points file.
+    """
+    with open(filepath, mode='rb') as data_file:
+        raw = data_file.read(HEADER.size)
+    if len(raw) < HEADER.size or raw[:4] != MAGIC:
+        raise ValueError(f'{filepath} is not a binary points file')
+    magic, version, code, count, *values = HEADER.unpack(raw)
+    if version != FORMAT_VERSION or code not in DTYPES:
+        raise ValueError(f'{filepath} has unsupported version {version} or dtype {chr(code)}')
+    return {'version': version, 'dtype': DTYPES[code], 'count': count,
+            'bounds': np.array(values[:4]), 'search': np.array(values[4:]).reshape(2, 2)}
+
+
+def open_points_binary(filepath: str):
+    """
+    Open a binary points file without reading it: the points are a
+    read-only (N, 2) np.memmap over the file, int32 or float64 as written.
+
+    :return: Tuple of: (N, 2) points, (2, 2) search area and the header
+    """
+    header = read_header(filepath)
+    search = header['search']
+    if header['dtype'].kind == 'i':
+        search = search.astype(np.int64)
+    if header['count'] == 0:
+        return np.zeros((0, 2), dtype=header['dtype']), search, header
+    points = np.memmap(filepath, dtype=header['dtype'], mode='r', offset=HEADER.size,
+                       shape=(header['count'], 2))
+    return points, search, header
+
+
+def convert_text_file(text_path: str, binary_path: str = None) -> str:
+    """
+    Convert a text points file to the binary format, streaming it so the
+    text file does not need to fit in memory. Returns the binary path.
+    """
+    from Lab1.main import stream_points
+
+    binary_path = binary_path or text_path + '.pts'
+    search, chunks = stream_points(text_path)
+    with PointFileWriter(binary_path, search) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    return binary_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print('Use:\n    python -m Lab1.point_file <text points file> [...]')
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        print(f'{path} -> {convert_text_file(path)}')
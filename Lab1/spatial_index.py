@@ -0,0 +1,38 @@
+"""
+Common interface of the range search engines, so callers and benchmarks can
+switch between them:
+    SegmentTree      -- Lab1.main, range tree of Point objects
+    ArraySegmentTree -- Lab1.array_tree, merge sort tree in NumPy arrays
+    GridIndex        -- Lab1.grid_index, uniform grid of buckets
+"""
+from abc import ABC, abstractmethod
+
+
+class SpatialIndex(ABC):
+    """
+    Index of 2D points answering axis aligned rectangle queries. Rectangles
+    are given by two opposite corners, each a Point or an (x, y) pair, with
+    inclusive bounds. SegmentTree reports sets of Point, the array engines
+    arrays of indices in the input points.
+    """
+    __slots__ = ()
+
+    @abstractmethod
+    def query(self, rect=None):
+        """
+        Points inside rect, or inside the search area of the index when rect
+        is None, in which case they are also kept in self.result.
+        """
+
+    @abstractmethod
+    def count(self, rect) -> int:
+        """
+        Number of points inside rect, duplicated points included.
+        """
+
+    @abstractmethod
+    def query_many(self, rects, count_only: bool = False):
+        """
+        Answer a batch of rectangles: a list of results, or an array of
+        counts when count_only.
+        """
@@ -0,0 +1,155 @@
+"""
+Index files of a built ArraySegmentTree, opened again without rebuilding:
+the arrays are memory mapped, so pages are only read when queries touch
+them and processes opening the same index share them.
+
+Header, little endian, 96 bytes:
+    magic    4s   b'ASTI'
+    version  H    INDEX_VERSION
+    search   ?    whether the tree has a search area
+    pad      x
+    count    Q    number of points
+    distinct Q    number of distinct y
+    levels   Q    number of levels
+    area     4q   x_min, x_max, y_min, y_max of the search area
+    checksum 32s  SHA-256 of the source points file, zeros when unknown
+then the int64 arrays index, xs, keys[0], ..., keys[levels - 1] of count
+items, the int64 array y_values of distinct items and the int32 arrays
+levels[0], ..., levels[levels - 1] of count items.
+
+Build, or open when up to date, the index of a points file with:
+    python -m Lab1.tree_index Lab1/data/10000points
+"""
+import hashlib
+import os
+import struct
+import sys
+
+import numpy as np
+
+from instrumentation import timed
+from Lab1.array_tree import ArraySegmentTree
+
+INDEX_MAGIC = b'ASTI'
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct('<4sH?xQQQ4q32s')
+NO_CHECKSUM = bytes(32)
+
+
+def file_checksum(filepath: str) -> bytes:
+    """
+    SHA-256 digest of a file, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, mode='rb') as data_file:
+        for block in iter(lambda: data_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def save_index(tree: ArraySegmentTree, filepath: str, source: str = None):
+    """
+    Write a built tree as an index file, with the checksum of the source
+    points file it was built from when given.
+    """
+    checksum = file_checksum(source) if source else NO_CHECKSUM
+    search = tree.x_cords is not None
+    area = (*tree.x_cords, *tree.y_cords) if search else (0, 0, 0, 0)
+    with open(filepath, mode='wb') as index_file:
+        index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, search, len(tree.xs), len(tree.y_values),
+                                           len(tree.levels), *area, checksum))
+        for array in (tree.index, tree.xs, *tree.keys, tree.y_values):
+            np.ascontiguousarray(array, dtype='<i8').tofile(index_file)
+        for array in tree.levels:
+            np.ascontiguousarray(array, dtype='<i4').tofile(index_file)
+
+
+def read_index_header(filepath: str) -> dict:
+    """
+    Parse and validate the header of an index file.
+    """
+    with open(filepath, mode='rb') as index_file:
+        raw = index_file.read(INDEX_HEADER.size)
+    if len(raw) < INDEX_HEADER.size or raw[:4] != INDEX_MAGIC:
+        raise ValueError(f'{filepath} is not a tree index file')
+    magic, version, search, count, distinct, levels, *values = INDEX_HEADER.unpack(raw)
+    if version != INDEX_VERSION:
+        raise ValueError(f'{filepath} has unsupported version {version}')
+    size = INDEX_HEADER.size + count * (8 * (2 + levels) + 4 * levels) + 8 * distinct
+    if os.path.getsize(filepath) != size:
+        raise ValueError(f'{filepath} is truncated or corrupted')
+    return {'version': version, 'count': count, 'distinct': distinct, 'levels': levels,
+            'area': tuple(values[:4]) if search else None, 'checksum': values[4]}
+
+
+@timed('load')
+def open_index(filepath: str, source: str = None) -> ArraySegmentTree:
+    """
+    Open an index file as a tree over read-only memory mapped arrays.
+    With source, the index must have been built from that points file,
+    else a ValueError tells it is stale.
+    """
+    header = read_index_header(filepath)
+    if source is not None and header['checksum'] != file_checksum(source):
+        raise ValueError(f'{filepath} was not built from the current {source}')
+    tree = ArraySegmentTree.__new__(ArraySegmentTree)
+    count = header['count']
+    if count == 0:
+        buffer = np.zeros(0, dtype=np.uint8)
+    else:
+        buffer = np.memmap(filepath, dtype=np.uint8, mode='r')
+    offset = INDEX_HEADER.size
+
+    def take(dtype, items=count):
+        nonlocal offset
+        array = np.ndarray(items, dtype=dtype, buffer=buffer, offset=offset) if items else np.zeros(0, dtype)
+        offset += array.nbytes
+        return array
+
+    tree.index = take('<i8')
+    tree.xs = take('<i8')
+    tree.keys = [take('<i8') for _ in range(header['levels'])]
+    tree.y_values = take('<i8', header['distinct'])
+    tree.levels = [take('<i4') for _ in range(header['levels'])]
+    tree.span = max(header['distinct'], 1)
+    area = header['area']
+    tree.x_cords = area[:2] if area else None
+    tree.y_cords = area[2:] if area else None
+    tree.result = np.zeros(0, dtype=np.intp)
+    tree.counter = 0
+    return tree
+
+
+def load_or_build(source: str, index_path: str = None, workers: int = 1) -> ArraySegmentTree:
+    """
+    Tree of a points file, text or binary (.pts), opened from its index
+    file when one is up to date, else built and saved as the index. Binary
+    files must have int32 coordinates, float64 ones raise a ValueError.
+    """
+    index_path = index_path or source + '.idx'
+    if os.path.exists(index_path):
+        try:
+            return open_index(index_path, source)
+        except ValueError:
+            pass
+    if source.endswith('.pts'):
+        from Lab1.point_file import open_points_binary
+
+        points, search, header = open_points_binary(source)
+        if header['dtype'].kind != 'i':
+            raise ValueError(f'{source} has float coordinates, the tree index needs an int32 points file')
+    else:
+        from Lab1.main import load_points
+
+        points, search = load_points(source)
+    tree = ArraySegmentTree(points, search, workers=workers)
+    save_index(tree, index_path, source)
+    return tree
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print('Use:\n    python -m Lab1.tree_index <points file> [...]')
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        print(f'{path}: {len(load_or_build(path).query())} points in the search area')
@@ -1,19 +1,209 @@
 # -*- coding: ascii -*-
 """
 Simple structured Delaunay triangulation in 2D with incremental(Bowyer-Watson) algorithm.
+
+Run the demo from the repository root, which makes the instrumentation
+module importable:
+    python -m Lab2.delaunay
 """
-import time
+import random
+from array import array
+from collections import deque
+from fractions import Fraction
+from heapq import heappop, heappush
+from itertools import islice, takewhile
+from time import perf_counter
 
 import matplotlib
 import numpy as np
-from math import sqrt
 
 from matplotlib import pyplot as plt
 
+from instrumentation import metrics, timed
+
+
+# Relative error bounds of the float evaluation of the predicates
+# (Shewchuk, "Adaptive Precision Floating-Point Arithmetic and Fast
+# Robust Geometric Predicates"), epsilon being half an ulp of 1.0
+EPSILON = 2.0 ** -53
+CCW_ERR_BOUND = (3.0 + 16.0 * EPSILON) * EPSILON
+ICC_ERR_BOUND = (10.0 + 96.0 * EPSILON) * EPSILON
+
+# Cavities with at least this many new triangles get their circles
+# computed in a single vectorized call
+BATCH_CIRCLES = 16
+
+
+def orient2d(ax, ay, bx, by, cx, cy):
+    """
+    Orientation of triangle abc: positive when counterclockwise, negative
+    when clockwise and zero when collinear. The sign is always exact, the
+    float result is used unless it is within its error bound, in which
+    case the determinant is recomputed with rationals.
+    """
+    detleft = (ax - cx) * (by - cy)
+    detright = (ay - cy) * (bx - cx)
+    det = detleft - detright
+    if abs(det) > CCW_ERR_BOUND * (abs(detleft) + abs(detright)):
+        return det
+    ax, ay, bx, by, cx, cy = map(Fraction, (ax, ay, bx, by, cx, cy))
+    return float((ax - cx) * (by - cy) - (ay - cy) * (bx - cx))
+
+
+def incircle(ax, ay, bx, by, cx, cy, dx, dy):
+    """
+    Position of d against the circumcircle of the counterclockwise triangle
+    abc: positive inside, negative outside and zero on the circle. Filtered
+    as orient2d, falling back to rationals near zero.
+    """
+    adx = ax - dx
+    ady = ay - dy
+    bdx = bx - dx
+    bdy = by - dy
+    cdx = cx - dx
+    cdy = cy - dy
+    bdxcdy = bdx * cdy
+    cdxbdy = cdx * bdy
+    cdxady = cdx * ady
+    adxcdy = adx * cdy
+    adxbdy = adx * bdy
+    bdxady = bdx * ady
+    alift = adx * adx + ady * ady
+    blift = bdx * bdx + bdy * bdy
+    clift = cdx * cdx + cdy * cdy
+    det = alift * (bdxcdy - cdxbdy) + blift * (cdxady - adxcdy) + clift * (adxbdy - bdxady)
+    permanent = ((abs(bdxcdy) + abs(cdxbdy)) * alift
+                 + (abs(cdxady) + abs(adxcdy)) * blift
+                 + (abs(adxbdy) + abs(bdxady)) * clift)
+    if abs(det) > ICC_ERR_BOUND * permanent:
+        return det
+    ax, ay, bx, by, cx, cy, dx, dy = map(Fraction, (ax, ay, bx, by, cx, cy, dx, dy))
+    adx, ady, bdx, bdy, cdx, cdy = ax - dx, ay - dy, bx - dx, by - dy, cx - dx, cy - dy
+    return float((adx * adx + ady * ady) * (bdx * cdy - cdx * bdy)
+                 + (bdx * bdx + bdy * bdy) * (cdx * ady - adx * cdy)
+                 + (cdx * cdx + cdy * cdy) * (adx * bdy - bdx * ady))
+
+
+def circumcircle(ax, ay, bx, by, cx, cy):
+    """
+    Closed-form circum-center and squared circum-radius of triangle abc.
+    Works on plain floats, coordinates are taken relative to a to keep
+    precision when the triangle is far from the origin.
+    """
+    bx -= ax
+    by -= ay
+    cx -= ax
+    cy -= ay
+    b2 = bx * bx + by * by
+    c2 = cx * cx + cy * cy
+    d = 2.0 * (bx * cy - by * cx)
+    ux = (cy * b2 - by * c2) / d
+    uy = (bx * c2 - cx * b2) / d
+    return (ax + ux, ay + uy), ux * ux + uy * uy
+
+
+def circumcircles(pts):
+    """
+    Vectorized circumcircle for an array of triangles of shape (k, 3, 2).
+    Returns the (k, 2) centers and the (k,) squared radii.
+    """
+    b = pts[:, 1] - pts[:, 0]
+    c = pts[:, 2] - pts[:, 0]
+    b2 = np.einsum('ij,ij->i', b, b)
+    c2 = np.einsum('ij,ij->i', c, c)
+    d = 2.0 * (b[:, 0] * c[:, 1] - b[:, 1] * c[:, 0])
+    u = np.empty_like(b)
+    u[:, 0] = (c[:, 1] * b2 - b[:, 1] * c2) / d
+    u[:, 1] = (b[:, 0] * c2 - c[:, 0] * b2) / d
+    return pts[:, 0] + u, np.einsum('ij,ij->i', u, u)
+
+
+def hilbert_index(x, y, order=16):
+    """
+    Index along a Hilbert curve of the integer grid positions x, y in
+    [0, 2^order), computed for whole arrays at once.
+    """
+    x = np.array(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    d = np.zeros(x.shape, dtype=np.int64)
+    n = 1 << order
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve stays continuous
+        flip = ~ry & rx
+        x[flip] = n - 1 - x[flip]
+        y[flip] = n - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap].copy()
+        s >>= 1
+    return d
+
+
+def brio_order(points, rng=None, order=16):
+    """
+    Biased randomized insertion order of an (N, 2) array: points are split
+    in rounds of roughly doubling size by coin flips, and each round is
+    sorted along a Hilbert curve. Returns the permutation of indices.
+    """
+    rng = np.random.default_rng(rng)
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    if n == 0:
+        return np.zeros(0, dtype=np.intp)
+    # A point lands in round r with probability 2^-(r+1), round 0 is the last
+    rounds = np.minimum(rng.geometric(0.5, size=n) - 1, max(int(np.log2(n)), 0))
+    return np.lexsort((hilbert_keys(points, order), -rounds))
+
+
+def hilbert_keys(points, order=16):
+    """
+    Hilbert curve index of each point of an (N, 2) array, over a grid of
+    2^order cells spanning the points.
+    """
+    low = points.min(axis=0)
+    span = np.maximum(points.max(axis=0) - low, np.finfo(float).tiny)
+    cells = ((points - low) / span * ((1 << order) - 1)).astype(np.int64)
+    return hilbert_index(cells[:, 0], cells[:, 1], order)
+
+
+def clip_polygon(polygon, bounds):
+    """
+    Clip a convex polygon, a list of (x, y), to the box
+    (x_min, y_min, x_max, y_max) with the Sutherland-Hodgman algorithm.
+    """
+    x_min, y_min, x_max, y_max = bounds
+    # Each side of the box as (axis, limit, keep the lower side)
+    for axis, limit, lower in ((0, x_min, False), (0, x_max, True), (1, y_min, False), (1, y_max, True)):
+        clipped = []
+        for k, current in enumerate(polygon):
+            previous = polygon[k - 1]
+            inside = current[axis] <= limit if lower else current[axis] >= limit
+            was_inside = previous[axis] <= limit if lower else previous[axis] >= limit
+            if inside != was_inside:
+                # Add where the edge crosses the side
+                t = (limit - previous[axis]) / (current[axis] - previous[axis])
+                point = [previous[0] + t * (current[0] - previous[0]), previous[1] + t * (current[1] - previous[1])]
+                point[axis] = limit
+                clipped.append(point)
+            if inside:
+                clipped.append(current)
+        polygon = clipped
+    return polygon
+
 
 class Delaunay:
     """
     Class to compute a Delaunay triangulation in 2D
+
+    The mesh is kept as a struct of arrays indexed by triangle slot: three
+    int32 vertex ids, three int32 neighbour slots (-1 for none, neighbour i
+    is opposite to vertex i) and the circumcircle (cx, cy, r^2) as float64.
+    Deleted slots are marked with vertex -1 and reused through a free list.
+    Each vertex also keeps the slot of one of its triangles, so its star is
+    found without walking the mesh.
     """
 
     def __init__(self, center=(0, 0), radius=9999):
@@ -22,76 +212,286 @@ class Delaunay:
         center -- Optional position for the center of the frame. Default (0,0)
         radius -- Optional distance from corners to the center.
         """
-        center = np.asarray(center)
+        x, y = float(center[0]), float(center[1])
+        radius = float(radius)
+        # Flat coordinate buffer x0, y0, x1, y1, ... with spare capacity
+        self._coords = array('d', bytes(8 * 2 * 64))
+        self.n_coords = 0
+        # Slot of one triangle of each vertex, -1 when it is not in the mesh
+        self._vertex_triangle = array('i')
         # Create coordinates for the corners of the frame
-        self.coords = [center + radius * np.array((-1, -1)),
-                       center + radius * np.array((+1, -1)),
-                       center + radius * np.array((+1, +1)),
-                       center + radius * np.array((-1, +1))]
-
-        # Create two dicts to store triangle neighbours and circles.
-        self.triangles = {}
-        self.circles = {}
+        for dx, dy in ((-1, -1), (+1, -1), (+1, +1), (-1, +1)):
+            self._add_coord(x + radius * dx, y + radius * dy)
+
+        # Per slot triangle vertices, neighbours and circles
+        self._vertices = array('i')
+        self._neighbours = array('i')
+        self._circles = array('d')
+        self._free = []
+        # Cache of the exported triangles and circles, see _refresh_export.
+        # Slots changed since it was built, None when it must be rebuilt
+        self._dirty = None
+        self._dirty_limit = 0
+        self._export_rows = None
 
         # Create two CCW triangles for the frame
-        T1 = (0, 1, 3)
-        T2 = (2, 3, 1)
-        self.triangles[T1] = [T2, None, None]
-        self.triangles[T2] = [T1, None, None]
+        T1 = self._new_triangle(0, 1, 3)
+        T2 = self._new_triangle(2, 3, 1)
+        self._neighbours[3 * T1] = T2
+        self._neighbours[3 * T2] = T1
+
+        # Triangle where the next point location walk starts
+        self.last_triangle = T1
+
+    @property
+    def coords(self):
+        """(n, 2) view of the vertex coordinates, frame corners first."""
+        return np.frombuffer(self._coords, dtype=np.float64, count=2 * self.n_coords).reshape(-1, 2)
+
+    @property
+    def triangles(self):
+        """(slots, 3) view of the triangle vertices, -1 rows are free slots."""
+        return np.frombuffer(self._vertices, dtype=np.int32).reshape(-1, 3)
+
+    @property
+    def neighbours(self):
+        """(slots, 3) view of the triangle neighbours, -1 when missing."""
+        return np.frombuffer(self._neighbours, dtype=np.int32).reshape(-1, 3)
+
+    @property
+    def circles(self):
+        """(slots, 3) view of the circumcircles as (cx, cy, r^2)."""
+        return np.frombuffer(self._circles, dtype=np.float64).reshape(-1, 3)
+
+    def _add_coord(self, x, y):
+        """
+        Append a vertex and return its index. The buffer is reallocated
+        instead of resized, so views handed out before stay valid.
+        """
+        idx = self.n_coords
+        if 2 * idx == len(self._coords):
+            self._coords = self._coords + array('d', bytes(8 * len(self._coords)))
+        self._coords[2 * idx] = x
+        self._coords[2 * idx + 1] = y
+        self._vertex_triangle.append(-1)
+        self.n_coords += 1
+        return idx
+
+    def _add_coords(self, points):
+        """
+        Append an (N, 2) array of vertices at once.
+        """
+        n = self.n_coords + len(points)
+        if 2 * n > len(self._coords):
+            size = len(self._coords)
+            while 2 * n > size:
+                size *= 2
+            self._coords = self._coords + array('d', bytes(8 * (size - len(self._coords))))
+        buffer = np.frombuffer(self._coords, dtype=np.float64)
+        buffer[2 * self.n_coords:2 * n] = points.ravel()
+        self._vertex_triangle.extend(array('i', [-1]) * len(points))
+        self.n_coords = n
+
+    def _reserve(self, count):
+        """
+        Make sure at least count free slots are available. The buffers are
+        reallocated instead of resized, so views handed out before stay valid.
+        """
+        if len(self._free) < count:
+            slots = len(self._vertices) // 3
+            grow = max(slots, count, 64)
+            self._vertices = self._vertices + array('i', [-1]) * (3 * grow)
+            self._neighbours = self._neighbours + array('i', [-1]) * (3 * grow)
+            self._circles = self._circles + array('d', bytes(8 * 3 * grow))
+            self._free[:0] = range(slots + grow - 1, slots - 1, -1)
+
+    def _new_triangle(self, a, b, c, circle=None):
+        """
+        Store triangle (a, b, c) in a free slot and return the slot, which
+        becomes the triangle of its vertices. Neighbours are left unset (-1).
+        """
+        self._reserve(1)
+        t = self._free.pop()
+        i = 3 * t
+        self._vertices[i] = a
+        self._vertices[i + 1] = b
+        self._vertices[i + 2] = c
+        self._vertex_triangle[a] = self._vertex_triangle[b] = self._vertex_triangle[c] = t
+        self._neighbours[i] = self._neighbours[i + 1] = self._neighbours[i + 2] = -1
+        self._touch(t)
+        (x, y), radius = circle if circle is not None else self.circum_center((a, b, c))
+        self._circles[i] = x
+        self._circles[i + 1] = y
+        self._circles[i + 2] = radius
+        return t
+
+    def _delete_triangle(self, t):
+        """
+        Release slot t for reuse.
+        """
+        self._vertices[3 * t] = self._vertices[3 * t + 1] = self._vertices[3 * t + 2] = -1
+        self._free.append(t)
+        self._touch(t)
 
-        # Compute circum-centers and circum-radius for each triangle
-        for t in self.triangles:
-            self.circles[t] = self.circum_center(t)
+    def _touch(self, t):
+        """
+        Mark slot t as changed for the export cache.
+        """
+        dirty = self._dirty
+        if dirty is not None:
+            dirty.add(t)
+            if len(dirty) > self._dirty_limit:
+                # Rebuilding at once is cheaper than that many updates
+                self._dirty = None
 
     def circum_center(self, tri):
         """
-        Compute circum-center and circum-radius of a triangle.
-        Uses an extension of the method described here:
-        http://www.ics.uci.edu/~eppstein/junkyard/circumcenter.html
+        Compute circum-center and circum-radius of a triangle given by vertex ids.
+        Returns the center as a pair of floats and the squared radius.
         """
-        pts = np.asarray([self.coords[v] for v in tri])
-        pts2 = np.dot(pts, pts.T)
-        A = np.bmat([[2 * pts2, [[1],
-                                 [1],
-                                 [1]]],
-                     [[[1, 1, 1, 0]]]])
-
-        b = np.hstack((np.sum(pts * pts, axis=1), [1]))
-        x = np.linalg.solve(A, b)
-        bary_coords = x[:-1]
-        center = np.dot(bary_coords, pts)
+        xy = self._coords
+        a, b, c = tri
+        return circumcircle(xy[2 * a], xy[2 * a + 1], xy[2 * b], xy[2 * b + 1], xy[2 * c], xy[2 * c + 1])
 
-        # radius = np.linalg.norm(pts[0] - center) # euclidean distance
-        radius = np.sum(np.square(pts[0] - center))  # squared distance
-        return center, radius
+    def circum_centers(self, tris):
+        """
+        Compute circum-centers and circum-radius of several triangles at once.
+        Returns a list of (center, radius) pairs as circum_center does.
+        """
+        pts = self.coords[np.asarray(tris, dtype=np.intp)]
+        centers, radii = circumcircles(pts)
+        return list(zip(map(tuple, centers.tolist()), radii.tolist()))
 
     def in_circle(self, tri, p):
         """
-        Check if point p is inside of precomputed circumcircle of tri.
+        Check if point p is strictly inside of the circumcircle of slot tri,
+        using the exact incircle predicate.
+        """
+        xy = self._coords
+        i = 3 * tri
+        a = 2 * self._vertices[i]
+        b = 2 * self._vertices[i + 1]
+        c = 2 * self._vertices[i + 2]
+        return incircle(xy[a], xy[a + 1], xy[b], xy[b + 1], xy[c], xy[c + 1], p[0], p[1]) > 0
+
+    def orientation(self, a, b, p):
+        """
+        Sign-exact orientation of (coords[a], coords[b], p), positive when
+        p lies to the left of the directed edge a -> b.
+        """
+        xy = self._coords
+        return orient2d(xy[2 * a], xy[2 * a + 1], xy[2 * b], xy[2 * b + 1], p[0], p[1])
+
+    def locate(self, p):
+        """
+        Find the slot of the triangle containing point p walking across
+        neighbours, starting from the last created triangle (visibility walk).
         """
-        center, radius = self.circles[tri]
-        return np.sum(np.square(center - p)) <= radius
+        vertices = self._vertices
+        T = self.last_triangle
+        if vertices[3 * T] < 0:
+            T = next(t for t in range(len(vertices) // 3) if vertices[3 * t] >= 0)
+        # Start each step from a random edge so the walk can not cycle
+        start = random.randrange(3)
+        steps = 1
+        while True:
+            for k in range(3):
+                edge = (start + k) % 3
+                i = 3 * T
+                if self.orientation(vertices[i + (edge + 1) % 3], vertices[i + (edge + 2) % 3], p) < 0:
+                    # p lies beyond this edge, cross it
+                    tri_op = self._neighbours[i + edge]
+                    if tri_op < 0:
+                        raise ValueError("Point %s is outside of the frame" % (p,))
+                    T = tri_op
+                    start = random.randrange(3)
+                    steps += 1
+                    break
+            else:
+                metrics.count('triangles_visited', steps)
+                return T
+
+    def find_cavity(self, T, p):
+        """
+        Collect the triangles whose circum-circle contains p with a BFS
+        over neighbours, starting from triangle T which contains p.
+        """
+        neighbours = self._neighbours
+        bad_triangles = [T]
+        visited = {T}
+        queue = deque(bad_triangles)
+        while queue:
+            i = 3 * queue.popleft()
+            for tri_op in (neighbours[i], neighbours[i + 1], neighbours[i + 2]):
+                if tri_op >= 0 and tri_op not in visited:
+                    visited.add(tri_op)
+                    if self.in_circle(tri_op, p):
+                        bad_triangles.append(tri_op)
+                        queue.append(tri_op)
+        return bad_triangles
 
     def add_point(self, p):
         """
         Add a point to the current DT, and refine it using algorithm.
         """
-        p = np.asarray(p)
-        idx = len(self.coords)
-        # print("coords[", idx,"] ->",p)
-        self.coords.append(p)
+        idx = self._add_coord(float(p[0]), float(p[1]))
+        self._insert(idx)
 
-        # Search the triangle(s) whose circum-circle contains p
-        bad_triangles = []
-        for T in self.triangles:
-            # Choose one method: inCircleRobust(T, p) or inCircleFast(T, p)
-            if self.in_circle(T, p):
-                bad_triangles.append(T)
+    def is_duplicate(self, T, p):
+        """
+        Check if p coincides with a vertex of the triangle slot T.
+        """
+        xy = self._coords
+        for n in range(3):
+            v = self._vertices[3 * T + n]
+            if xy[2 * v] == p[0] and xy[2 * v + 1] == p[1]:
+                return True
+        return False
+
+    @timed('build')
+    def add_points(self, points, seed=None):
+        """
+        Add an (N, 2) array of points in bulk. Points keep their order in
+        the array as indices, but are inserted following a BRIO of Hilbert
+        sorted rounds, so walks stay short and cavities stay local.
+        seed -- Optional seed of the randomized rounds.
+        Returns the build throughput in points per second.
+        """
+        points = np.asarray(points, dtype=float)
+        if points.ndim != 2 or points.shape[1] != 2:
+            raise ValueError("Expected an (N, 2) array of points, got shape %s" % (points.shape,))
+        start = perf_counter()
+        first = self.n_coords
+        self._add_coords(points)
+        for i in brio_order(points, seed).tolist():
+            self._insert(first + i)
+        elapsed = perf_counter() - start
+        return len(points) / elapsed if elapsed > 0 else float('inf')
+
+    def _insert(self, idx):
+        """
+        Insert the already stored vertex idx in the triangulation.
+        A duplicate of an existing vertex is left out of the mesh.
+        Returns whether the vertex was inserted.
+        """
+        vertices = self._vertices
+        neighbours = self._neighbours
+        p = (self._coords[2 * idx], self._coords[2 * idx + 1])
+
+        # Walk to the triangle containing p and grow the cavity of
+        # triangles whose circum-circle contains p from there
+        T = self.locate(p)
+        if self.is_duplicate(T, p):
+            metrics.count('duplicates')
+            return False
+        bad_triangles = self.find_cavity(T, p)
+        metrics.count('cavity_triangles', len(bad_triangles))
 
         # Find the CCW boundary (star shape) of the bad triangles,
         # expressed as a list of edges (point pairs) and the opposite
         # triangle to each edge.
         boundary = []
+        bad_set = set(bad_triangles)
         # Choose a "random" triangle and edge
         T = bad_triangles[0]
         edge = 0
@@ -99,10 +499,11 @@ class Delaunay:
         while True:
             # Check if edge of triangle T is on the boundary...
             # if opposite triangle of this edge is external to the list
-            tri_op = self.triangles[T][edge]
-            if tri_op not in bad_triangles:
+            i = 3 * T
+            tri_op = neighbours[i + edge]
+            if tri_op not in bad_set:
                 # Insert edge and external triangle into boundary list
-                boundary.append((T[(edge + 1) % 3], T[(edge - 1) % 3], tri_op))
+                boundary.append((vertices[i + (edge + 1) % 3], vertices[i + (edge + 2) % 3], tri_op))
 
                 # Move to next CCW edge in this triangle
                 edge = (edge + 1) % 3
@@ -112,34 +513,38 @@ class Delaunay:
                     break
             else:
                 # Move to next CCW edge in opposite triangle
-                edge = (self.triangles[tri_op].index(T) + 1) % 3
+                j = 3 * tri_op
+                edge = ((0 if neighbours[j] == T else 1 if neighbours[j + 1] == T else 2) + 1) % 3
                 T = tri_op
 
         # Remove triangles too near of point p of our solution
         for T in bad_triangles:
-            del self.triangles[T]
-            del self.circles[T]
+            self._delete_triangle(T)
 
         # Retriangle the hole left by bad_triangles
+        self._reserve(len(boundary))
+        vertices = self._vertices
+        neighbours = self._neighbours
         new_triangles = []
-        for (e0, e1, tri_op) in boundary:
-            # Create a new triangle using point p and edge extremes
-            T = (idx, e0, e1)
-
-            # Store circum-center and circum-radius of the triangle
-            self.circles[T] = self.circum_center(T)
+        if len(boundary) >= BATCH_CIRCLES:
+            circles = self.circum_centers([(idx, e0, e1) for (e0, e1, _) in boundary])
+        else:
+            circles = None
+        for k, (e0, e1, tri_op) in enumerate(boundary):
+            # Create a new triangle using point p and edge extremes,
+            # storing its circum-center and circum-radius
+            T = self._new_triangle(idx, e0, e1, circles[k] if circles else None)
 
             # Set opposite triangle of the edge as neighbour of T
-            self.triangles[T] = [tri_op, None, None]
+            neighbours[3 * T] = tri_op
 
-            # Try to set T as neighbour of the opposite triangle
-            if tri_op:
-                # search the neighbour of tri_op that use edge (e1, e0)
-                for i, neigh in enumerate(self.triangles[tri_op]):
-                    if neigh:
-                        if e1 in neigh and e0 in neigh:
-                            # change link to use our new triangle
-                            self.triangles[tri_op][i] = T
+            # Set T as neighbour of the opposite triangle, on the edge
+            # (e1, e0) which is opposite to its third vertex
+            if tri_op >= 0:
+                j = 3 * tri_op
+                for n in range(3):
+                    if vertices[j + n] != e0 and vertices[j + n] != e1:
+                        neighbours[j + n] = T
 
             # Add triangle to a temporal list
             new_triangles.append(T)
@@ -147,64 +552,431 @@ class Delaunay:
         # Link the new triangles each another
         N = len(new_triangles)
         for i, T in enumerate(new_triangles):
-            self.triangles[T][1] = new_triangles[(i + 1) % N]  # next
-            self.triangles[T][2] = new_triangles[(i - 1) % N]  # previous
+            neighbours[3 * T + 1] = new_triangles[(i + 1) % N]  # next
+            neighbours[3 * T + 2] = new_triangles[(i - 1) % N]  # previous
+
+        # Next walk starts from the neighbourhood of this point
+        self.last_triangle = new_triangles[0]
+        metrics.count('points_inserted')
+        return True
+
+    def _vertex(self, index):
+        """
+        Vertex id of point index, raising IndexError when out of range.
+        """
+        if not 0 <= index < self.n_coords - 4:
+            raise IndexError("Point index %d out of range" % index)
+        return index + 4
+
+    def _in_frame(self, p):
+        """
+        Check if p lies strictly inside of the frame.
+        """
+        xy = self._coords
+        return xy[0] < p[0] < xy[4] and xy[1] < p[1] < xy[5]
+
+    def star(self, v, T=None):
+        """
+        Triangles around vertex v in counterclockwise order, as a list of
+        (slot, a, b, outer): the slot is the triangle (v, a, b) and outer
+        the neighbour across its edge (a, b). Empty when v is not in the
+        mesh, as a duplicate point. The fan of a frame corner is open, it
+        starts and ends on the border of the frame.
+        T -- Optional slot of a triangle of v, else the one kept for v.
+        """
+        vertices = self._vertices
+        neighbours = self._neighbours
+        if T is None:
+            T = self._vertex_triangle[v]
+            if T < 0:
+                return []
+        result = []
+        start = T
+        while True:
+            i = 3 * T
+            k = 0 if vertices[i] == v else 1 if vertices[i + 1] == v else 2
+            result.append((T, vertices[i + (k + 1) % 3], vertices[i + (k + 2) % 3], neighbours[i + k]))
+            T = neighbours[i + (k + 1) % 3]
+            if T == start:
+                return result
+            if T < 0:
+                break
+        # Reached the border, add the triangles before start going clockwise
+        i = 3 * start
+        k = 0 if vertices[i] == v else 1 if vertices[i + 1] == v else 2
+        T = neighbours[i + (k + 2) % 3]
+        before = []
+        while T >= 0:
+            i = 3 * T
+            k = 0 if vertices[i] == v else 1 if vertices[i + 1] == v else 2
+            before.append((T, vertices[i + (k + 1) % 3], vertices[i + (k + 2) % 3], neighbours[i + k]))
+            T = neighbours[i + (k + 2) % 3]
+        return before[::-1] + result
+
+    def _link(self, T, tri_op, e0, e1):
+        """
+        Set T as neighbour of tri_op across their common edge (e0, e1).
+        """
+        if tri_op >= 0:
+            j = 3 * tri_op
+            vertices = self._vertices
+            for n in range(3):
+                if vertices[j + n] != e0 and vertices[j + n] != e1:
+                    self._neighbours[j + n] = T
+
+    def remove_point(self, index):
+        """
+        Remove point index from the triangulation. Its coordinates stay
+        stored so the other indices do not change. The star shaped hole is
+        filled again by Delaunay ears: convex corners of the hole whose
+        circum-circle contains no other vertex of the hole.
+        Returns whether the point was in the mesh.
+        """
+        v = self._vertex(index)
+        star = self.star(v)
+        if not star:
+            return False
+        for T, _, _, _ in star:
+            self._delete_triangle(T)
+        self._vertex_triangle[v] = -1
+        # Hole boundary, polygon[j] -> polygon[j + 1] is edge j with outer[j] across
+        polygon = [a for _, a, _, _ in star]
+        outer = [tri_op for _, _, _, tri_op in star]
+        xy = self._coords
+        self._reserve(len(polygon) - 2)
+        while len(polygon) > 3:
+            m = len(polygon)
+            for j in range(m):
+                a, b, c = polygon[j - 1], polygon[j], polygon[(j + 1) % m]
+                ax, ay, bx, by, cx, cy = xy[2 * a], xy[2 * a + 1], xy[2 * b], xy[2 * b + 1], xy[2 * c], xy[2 * c + 1]
+                if orient2d(ax, ay, bx, by, cx, cy) > 0 and \
+                        all(incircle(ax, ay, bx, by, cx, cy, xy[2 * d], xy[2 * d + 1]) <= 0
+                            for d in polygon if d != a and d != b and d != c):
+                    break
+            # Cut the ear (a, b, c), its edge (c, a) becomes a hole edge
+            T = self._new_triangle(a, b, c)
+            self._neighbours[3 * T] = outer[j]
+            self._neighbours[3 * T + 2] = outer[j - 1]
+            self._link(T, outer[j], b, c)
+            self._link(T, outer[j - 1], a, b)
+            outer[j - 1] = T
+            del polygon[j], outer[j]
+        a, b, c = polygon
+        T = self._new_triangle(a, b, c)
+        for n, (tri_op, e0, e1) in enumerate(((outer[1], b, c), (outer[2], c, a), (outer[0], a, b))):
+            self._neighbours[3 * T + n] = tri_op
+            self._link(T, tri_op, e0, e1)
+        self.last_triangle = T
+        return True
+
+    def move_point(self, index, p):
+        """
+        Move point index to p. When every triangle around it keeps its
+        orientation and stays locally Delaunay the point is moved in place,
+        only updating their circles. Else it is removed and inserted again.
+        Returns whether the point was moved in place.
+        """
+        v = self._vertex(index)
+        x, y = float(p[0]), float(p[1])
+        if not self._in_frame((x, y)):
+            raise ValueError("Point %s is outside of the frame" % (p,))
+        star = self.star(v)
+        xy = self._coords
+        if star and self._can_move(star, x, y):
+            xy[2 * v] = x
+            xy[2 * v + 1] = y
+            for T, a, b, _ in star:
+                (cx, cy), r2 = self.circum_center((v, a, b))
+                self._circles[3 * T] = cx
+                self._circles[3 * T + 1] = cy
+                self._circles[3 * T + 2] = r2
+                self._touch(T)
+            return True
+        if star:
+            self.remove_point(index)
+        xy[2 * v] = x
+        xy[2 * v + 1] = y
+        self._insert(v)
+        return False
+
+    def _can_move(self, star, x, y):
+        """
+        Check if the star of a vertex stays a valid Delaunay star with the
+        vertex at (x, y): every triangle positively oriented, with no vertex
+        of its three neighbours strictly inside its circum-circle.
+        """
+        xy = self._coords
+        vertices = self._vertices
+        m = len(star)
+        for j, (_, a, b, tri_op) in enumerate(star):
+            ax, ay, bx, by = xy[2 * a], xy[2 * a + 1], xy[2 * b], xy[2 * b + 1]
+            if orient2d(x, y, ax, ay, bx, by) <= 0:
+                return False
+            others = [star[j - 1][1], star[(j + 1) % m][2]]
+            if tri_op >= 0:
+                i = 3 * tri_op
+                others += [d for d in (vertices[i], vertices[i + 1], vertices[i + 2]) if d != a and d != b]
+            for d in others:
+                if incircle(x, y, ax, ay, bx, by, xy[2 * d], xy[2 * d + 1]) > 0:
+                    return False
+        return True
+
+    def iter_nearest(self, p):
+        """
+        Yield (index, squared distance) of the points by increasing distance
+        to p. The walk locates p, then a best-first search grows over the
+        Delaunay edges from the vertices of the triangles whose circle
+        contains p, which are the neighbours p would have if inserted: the
+        next nearest point is always adjacent to one of them or to a point
+        already found. Duplicate points are only reported once.
+        """
+        x, y = float(p[0]), float(p[1])
+        T = self.locate((x, y))
+        self.last_triangle = T
+        xy = self._coords
+        vertices = self._vertices
+        heap = []
+        seen = set()
+        for S in self.find_cavity(T, (x, y)):
+            for n in range(3):
+                v = vertices[3 * S + n]
+                if v not in seen:
+                    seen.add(v)
+                    heappush(heap, ((xy[2 * v] - x) ** 2 + (xy[2 * v + 1] - y) ** 2, v, S))
+        while heap:
+            d2, v, S = heappop(heap)
+            # Frame corners are searched through but not reported
+            if v >= 4:
+                yield v - 4, d2
+            for slot, a, _, _ in self.star(v, S):
+                if a not in seen:
+                    seen.add(a)
+                    heappush(heap, ((xy[2 * a] - x) ** 2 + (xy[2 * a + 1] - y) ** 2, a, slot))
+
+    def nearest(self, p):
+        """
+        Index of the point nearest to p and its distance, (-1, inf) when
+        the mesh has no point.
+        """
+        for index, d2 in self.iter_nearest(p):
+            return index, np.sqrt(d2)
+        return -1, np.inf
+
+    def k_nearest(self, p, k):
+        """
+        Indices of the k points nearest to p and their distances, sorted by
+        distance, fewer when the mesh has less than k points.
+        """
+        found = list(islice(self.iter_nearest(p), k))
+        return np.array([index for index, _ in found], dtype=np.intp), np.sqrt([d2 for _, d2 in found])
+
+    def radius_neighbours(self, p, r):
+        """
+        Indices of the points at distance at most r from p and their
+        distances, sorted by distance.
+        """
+        r2 = float(r) ** 2
+        found = list(takewhile(lambda item: item[1] <= r2, self.iter_nearest(p)))
+        return np.array([index for index, _ in found], dtype=np.intp), np.sqrt([d2 for _, d2 in found])
+
+    def k_nearest_many(self, points, k=1, ordered=True):
+        """
+        k_nearest for an (M, 2) array of points. With ordered, the queries
+        run along a Hilbert curve so each walk starts near the previous
+        answer. Returns (M, k) indices and distances, padded with -1 and inf.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        indices = np.full((len(points), k), -1, dtype=np.intp)
+        distances = np.full((len(points), k), np.inf)
+        for q in self._query_order(points, ordered):
+            found, dist = self.k_nearest(points[q], k)
+            indices[q, :len(found)] = found
+            distances[q, :len(found)] = dist
+        return indices, distances
+
+    def radius_neighbours_many(self, points, r, ordered=True):
+        """
+        radius_neighbours for an (M, 2) array of points, in Hilbert order
+        with ordered. Returns the flat indices and distances and the (M + 1)
+        offsets: the neighbours of query i are indices[offsets[i]:offsets[i + 1]].
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        results = [None] * len(points)
+        for q in self._query_order(points, ordered):
+            results[q] = self.radius_neighbours(points[q], r)
+        offsets = np.zeros(len(points) + 1, dtype=np.intp)
+        offsets[1:] = np.cumsum([len(found) for found, _ in results])
+        if not results:
+            return np.zeros(0, dtype=np.intp), np.zeros(0), offsets
+        return np.concatenate([found for found, _ in results]), np.concatenate([d for _, d in results]), offsets
+
+    @staticmethod
+    def _query_order(points, ordered):
+        """
+        Order to answer a batch of queries in, as a list of indices.
+        """
+        if ordered and len(points) > 1:
+            return np.argsort(hilbert_keys(points), kind='stable').tolist()
+        return range(len(points))
+
+    def _real_slots(self):
+        """
+        Slots of live triangles with no vertex in the frame.
+        """
+        return np.flatnonzero((self.triangles > 3).all(axis=1))
 
     def get_triangles(self):
         """
-        Get the current list of Delaunay triangles
-        """
-        return [(a - 4, b - 4, c - 4)
-                for (a, b, c) in self.triangles if a > 3 and b > 3 and c > 3]
-
-    def export_voronoi_regions(self):
-        """Export coordinates and regions of Voronoi diagram as indexed data.
-        """
-        # Remember to compute circumcircles if not done before
-        # for t in self.triangles:
-        #     self.circles[t] = self.circumcenter(t)
-        useVertex = {i: [] for i in range(len(self.coords))}
-        vor_coors = []
-        index = {}
-        # Build a list of coordinates and one index per triangle/region
-        for tidx, (a, b, c) in enumerate(sorted(self.triangles)):
-            vor_coors.append(self.circles[(a, b, c)][0])
-            # Insert triangle, rotating it so the key is the "last" vertex
-            useVertex[a] += [(b, c, a)]
-            useVertex[b] += [(c, a, b)]
-            useVertex[c] += [(a, b, c)]
-            # Set tidx as the index to use with this triangle
-            index[(a, b, c)] = tidx
-            index[(c, a, b)] = tidx
-            index[(b, c, a)] = tidx
-
-        # init regions per coordinate dictionary
-        regions = {}
-        # Sort each region in a coherent order, and substitude each triangle
-        # by its index
-        for i in range(4, len(self.coords)):
-            v = useVertex[i][0][0]  # Get a vertex of a triangle
-            r = []
-            for _ in range(len(useVertex[i])):
-                # Search the triangle beginning with vertex v
-                t = [t for t in useVertex[i] if t[0] == v][0]
-                r.append(index[t])  # Add the index of this triangle to region
-                v = t[1]  # Choose the next vertex to search
-            regions[i - 4] = r  # Store region.
-
-        return vor_coors, regions
+        Get the current Delaunay triangles as a (T, 3) array of point indices.
+        The array is a read-only view of a cache that later changes of the
+        mesh update in place, copy it to keep a snapshot.
+        """
+        self._refresh_export()
+        return self._readonly(self._export_triangles[:self._export_count])
 
-    def exportCircles(self):
-        """Export the circumcircles as a list of (center, radius)
+    def _refresh_export(self):
+        """
+        Bring the cache of exported triangles and circles up to date. The
+        cache keeps one row per triangle with no frame vertex, and only the
+        slots changed since the last export are updated: an unchanged mesh
+        costs nothing, a lightly changed one what changed.
+        """
+        if self._dirty is None:
+            slots = self._real_slots()
+            count = len(slots)
+            capacity = count + count // 2 + 64
+            self._export_triangles = np.zeros((capacity, 3), dtype=np.int32)
+            self._export_circles = np.zeros((capacity, 3))
+            self._export_slots = np.zeros(capacity, dtype=np.intp)
+            self._export_rows = np.full(len(self._vertices) // 3, -1, dtype=np.intp)
+            self._export_triangles[:count] = self.triangles[slots] - 4
+            self._export_circles[:count] = self.circles[slots]
+            self._export_circles[:count, 2] = np.sqrt(self._export_circles[:count, 2])
+            self._export_slots[:count] = slots
+            self._export_rows[slots] = np.arange(count)
+            self._export_count = count
+            self._dirty = set()
+            self._dirty_limit = max(count // 4, 1024)
+            return
+        if not self._dirty:
+            return
+        vertices = self._vertices
+        circles = self._circles
+        slots = len(vertices) // 3
+        if len(self._export_rows) < slots:
+            self._export_rows = np.concatenate((self._export_rows,
+                                                np.full(slots - len(self._export_rows), -1, dtype=np.intp)))
+        rows = self._export_rows
+        for t in self._dirty:
+            i = 3 * t
+            row = rows[t]
+            if vertices[i] > 3 and vertices[i + 1] > 3 and vertices[i + 2] > 3:
+                if row < 0:
+                    row = self._export_count
+                    if row == len(self._export_slots):
+                        self._grow_export()
+                    self._export_count += 1
+                    self._export_slots[row] = t
+                    rows[t] = row
+                self._export_triangles[row] = (vertices[i] - 4, vertices[i + 1] - 4, vertices[i + 2] - 4)
+                self._export_circles[row] = (circles[i], circles[i + 1], np.sqrt(circles[i + 2]))
+            elif row >= 0:
+                # Move the last row into the hole
+                last = self._export_count - 1
+                moved = self._export_slots[last]
+                self._export_triangles[row] = self._export_triangles[last]
+                self._export_circles[row] = self._export_circles[last]
+                self._export_slots[row] = moved
+                rows[moved] = row
+                rows[t] = -1
+                self._export_count = last
+        self._dirty = set()
+
+    def _grow_export(self):
+        """
+        Reallocate the export cache with twice its capacity. Views handed
+        out before keep the old buffers.
         """
-        # Remember to compute circumcircles if not done before
-        # for t in self.triangles:
-        #     self.circles[t] = self.circumcenter(t)
+        grow = len(self._export_slots)
+        self._export_triangles = np.concatenate((self._export_triangles, np.zeros((grow, 3), dtype=np.int32)))
+        self._export_circles = np.concatenate((self._export_circles, np.zeros((grow, 3))))
+        self._export_slots = np.concatenate((self._export_slots, np.zeros(grow, dtype=np.intp)))
+
+    @staticmethod
+    def _readonly(view):
+        view = view.view()
+        view.flags.writeable = False
+        return view
+
+    def export_voronoi_regions(self, bounds=None, clip=True):
+        """
+        Export coordinates and regions of Voronoi diagram as indexed data.
+        The Voronoi vertices of a point are the circum-centers of the
+        triangles around it, found by walking across neighbours
+        counterclockwise, so the export is linear in the number of triangles.
+        bounds -- Optional (x_min, y_min, x_max, y_max) box. Default the frame.
+        clip -- Clip the regions to bounds. Regions along the hull reach the
+        far away circum-centers of the frame triangles otherwise.
+        Returns the (V, 2) coordinates, the flat region indices into them and
+        the (N + 1) offsets: region of point i is indices[offsets[i]:offsets[i + 1]],
+        empty for a duplicate point.
+        """
+        triangles = self.triangles
+        alive = np.flatnonzero(triangles[:, 0] >= 0)
+        # One Voronoi vertex per live slot
+        vor_coors = self.circles[alive, :2]
+        vertex_of = np.full(len(triangles), -1, dtype=np.intp)
+        vertex_of[alive] = np.arange(len(alive))
+        # A triangle around each point to start its walk from
+        first = np.full(self.n_coords, -1, dtype=np.intp)
+        first[triangles[alive].ravel()] = np.repeat(alive, 3)
+
+        if bounds is None:
+            corners = self.coords[:4]
+            bounds = (*corners.min(axis=0).tolist(), *corners.max(axis=0).tolist())
+        x_min, y_min, x_max, y_max = bounds
+        outside = ((vor_coors[:, 0] < x_min) | (vor_coors[:, 0] > x_max) |
+                   (vor_coors[:, 1] < y_min) | (vor_coors[:, 1] > y_max)).tolist() if clip else None
+
+        vertices = self._vertices
+        neighbours = self._neighbours
+        vertex_of = vertex_of.tolist()
+        extra = []
+        indices = []
+        offsets = [0]
+        for v, T in enumerate(first[4:].tolist(), 4):
+            if T >= 0:
+                region = []
+                start = T
+                while True:
+                    i = 3 * T
+                    region.append(vertex_of[T])
+                    # Next triangle shares the edge from v to the vertex after its successor
+                    k = 0 if vertices[i] == v else 1 if vertices[i + 1] == v else 2
+                    T = neighbours[i + (k + 1) % 3]
+                    if T == start:
+                        break
+                if clip and any(outside[j] for j in region):
+                    polygon = clip_polygon(vor_coors[region].tolist(), bounds)
+                    first_extra = len(vor_coors) + len(extra)
+                    extra += polygon
+                    region = range(first_extra, first_extra + len(polygon))
+                indices += region
+            offsets.append(len(indices))
+
+        if extra:
+            vor_coors = np.concatenate((vor_coors, np.array(extra)))
+        return vor_coors, np.array(indices, dtype=np.intp), np.array(offsets, dtype=np.intp)
 
-        # Filter out triangles with any vertex in the extended BBox
-        # Do sqrt of radius before of return
-        return [(self.circles[(a, b, c)][0], sqrt(self.circles[(a, b, c)][1]))
-                for (a, b, c) in self.triangles if a > 3 and b > 3 and c > 3]
+    def exportCircles(self):
+        """Export the circumcircles as (k, 2) centers and (k,) radius arrays,
+        in the order of get_triangles, as read-only views of the same cache
+        """
+        # Triangles with any vertex in the extended BBox are left out, and
+        # the radius is kept square rooted in the cache
+        self._refresh_export()
+        circles = self._export_circles[:self._export_count]
+        return self._readonly(circles[:, :2]), self._readonly(circles[:, 2])
 
 
 if __name__ == "__main__":
@@ -214,24 +986,8 @@ if __name__ == "__main__":
     center_loc = np.mean(seeds, axis=0)
 
     dt2 = Delaunay(center_loc, 50 * radius_loc)
-    for i, s in enumerate(seeds):
-        print("Inserting seed", i, s)
-        dt2.add_point(s)
-        time.sleep(0.5)
-        if i > 1:
-            fig, ax = plt.subplots()
-            ax.margins(0.1)
-            ax.set_aspect('equal')
-            plt.axis([-1, radius_loc + 1, -1, radius_loc + 1])
-            for i, v in enumerate(seeds):
-                plt.annotate(i, xy=v)  # Plot all seeds
-            for t in dt2.get_triangles():
-                polygon = [seeds[i] for i in t]  # Build polygon for each region
-                plt.fill(*zip(*polygon), fill=False, color="b")  # Plot filled polygon
-            for c, r in dt2.exportCircles():
-                ax.add_artist(plt.Circle(c, r, color='k', fill=False, ls='dotted'))
-
-            plt.show()
+    rate = dt2.add_points(seeds)
+    print("Inserted %d seeds, %.0f points/s" % (numSeeds, rate))
 
     # Create a plot with matplotlib.pyplot
     fig, ax = plt.subplots()
@@ -243,16 +999,20 @@ if __name__ == "__main__":
     cx, cy = zip(*seeds)
     dt_tris = dt2.get_triangles()
     ax.triplot(matplotlib.tri.Triangulation(cx, cy, dt_tris), '-')
-
-
-    # Build Voronoi diagram as a list of coordinates and regions
-    vc, vr = dt2.export_voronoi_regions()
-
-    # Plot voronoi diagram edges (in red)
-    for r in vr:
-        polygon = [vc[i] for i in vr[r]]  # Build polygon for each region
-        plt.fill(*zip(*polygon), alpha=0.2)  # Plot filled polygon
-        plt.annotate("r%d" % r, xy=np.average(polygon, axis=0))
+    for i, v in enumerate(seeds):
+        plt.annotate(i, xy=v)  # Plot all seeds
+    for c, r in zip(*dt2.exportCircles()):
+        ax.add_artist(plt.Circle(c, r, color='k', fill=False, ls='dotted'))
+
+    # Build Voronoi diagram as coordinates and regions, clipped to the plot
+    vc, indices, offsets = dt2.export_voronoi_regions(bounds=(-1, -1, radius_loc + 1, radius_loc + 1))
+
+    # Plot voronoi diagram regions
+    for r in range(len(offsets) - 1):
+        polygon = vc[indices[offsets[r]:offsets[r + 1]]]  # Build polygon for each region
+        if len(polygon):
+            plt.fill(*polygon.T, alpha=0.2)  # Plot filled polygon
+            plt.annotate("r%d" % r, xy=np.average(polygon, axis=0))
 
     # Dump plot to file
     # plt.savefig('output-delaunay2D.png', dpi=96)
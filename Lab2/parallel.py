@@ -0,0 +1,97 @@
+# -*- coding: ascii -*-
+"""
+Divide and conquer Delaunay triangulation on several processes.
+
+The points are split in vertical strips by x, and each strip is triangulated
+by a worker with the incremental engine. A triangle of a strip whose circle
+stays strictly between the neighbour strips can not contain any other point,
+so it belongs to the whole triangulation as is. The remaining triangles lie
+along the seams: their vertices are triangulated again in one piece, and the
+triangles of that seam triangulation that do not overlap the final ones
+complete the mesh.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Lab2.delaunay import Delaunay
+
+# Relative slack for the circles computed in floats when checking them
+# against the strip limits
+CIRCLE_SLACK = 1e-9
+
+
+def triangulate_strip(points, center, radius, left_limit, right_limit, seed=None):
+    """
+    Triangulate one strip, run in a worker process.
+    Returns the triangulation and a mask of its final triangle slots: the
+    ones with no frame vertex and a circle strictly inside
+    (left_limit, right_limit).
+    """
+    dt = Delaunay(center, radius)
+    dt.add_points(points, seed=seed)
+    circles = dt.circles
+    reach = np.sqrt(circles[:, 2]) * (1 + CIRCLE_SLACK) + CIRCLE_SLACK * np.abs(circles[:, 0])
+    final = (dt.triangles > 3).all(axis=1)
+    final &= circles[:, 0] - reach > left_limit
+    final &= circles[:, 0] + reach < right_limit
+    return dt, final
+
+
+def triangulate_parallel(points, center=(0, 0), radius=9999, workers=None, strips=None, seed=None):
+    """
+    Delaunay triangulation of an (N, 2) array of points inside the frame
+    given by center and radius, as Delaunay builds it, using worker processes.
+    workers -- Optional number of processes. Default one per CPU.
+    strips -- Optional number of strips. Default one per worker.
+    Returns the triangles as a (T, 3) array of point indices, as
+    Delaunay.get_triangles does.
+    """
+    points = np.asarray(points, dtype=float)
+    if points.ndim != 2 or points.shape[1] != 2:
+        raise ValueError("Expected an (N, 2) array of points, got shape %s" % (points.shape,))
+    workers = workers or os.cpu_count() or 1
+    strips = max(1, min(strips or workers, len(points) // 16))
+    if strips == 1:
+        dt = Delaunay(center, radius)
+        dt.add_points(points, seed=seed)
+        return dt.get_triangles()
+
+    # Split by x, each strip knows the x of the closest outer points
+    order = np.argsort(points[:, 0], kind='stable')
+    parts = np.array_split(order, strips)
+    limits = [(points[parts[s - 1][-1], 0] if s > 0 else -np.inf,
+               points[parts[s + 1][0], 0] if s + 1 < strips else np.inf) for s in range(strips)]
+    with ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(triangulate_strip, [points[part] for part in parts], [center] * strips,
+                                [radius] * strips, *zip(*limits), [seed] * strips))
+
+    # Keep final triangles, collect the seam vertices of all others
+    triangles = []
+    seam = []
+    for part, (dt, final) in zip(parts, results):
+        alive = dt.triangles[:, 0] >= 0
+        triangles.append(part[dt.triangles[final] - 4])
+        seam.append(part[np.unique(dt.triangles[alive & ~final])[4:] - 4])
+    seam = np.unique(np.concatenate(seam))
+
+    # Triangulate the seams again, dropping the triangles over final ones
+    dt = Delaunay(center, radius)
+    dt.add_points(points[seam], seed=seed)
+    candidates = seam[dt.get_triangles()]
+    for tri in candidates:
+        centroid = points[tri].mean(axis=0)
+        if not covered(centroid, results, limits):
+            triangles.append(tri[np.newaxis])
+    return np.concatenate(triangles)
+
+
+def covered(p, results, limits):
+    """
+    Check if point p lies in a final triangle of any strip.
+    """
+    for (dt, final), (left_limit, right_limit) in zip(results, limits):
+        if left_limit < p[0] < right_limit and final[dt.locate(p)]:
+            return True
+    return False
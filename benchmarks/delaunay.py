@@ -0,0 +1,97 @@
+"""
+Build throughput of the Delaunay triangulation: naive per-point
+insertion against the bulk BRIO / Hilbert add_points, and the speedup of
+the divide and conquer build over the number of worker processes.
+
+Usage (from the repository root):
+    python -m benchmarks.delaunay --sizes 10000 100000 --distribution clustered
+    python -m benchmarks.delaunay --sizes 100000 --workers 1 2 4 8
+"""
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+from instrumentation import metrics
+from Lab2.delaunay import Delaunay
+from Lab2.parallel import triangulate_parallel
+
+
+def make_points(n, distribution, rng):
+    """
+    Generate n points in [0, 1000)^2, either uniform or as gaussian clusters.
+    """
+    if distribution == "uniform":
+        return rng.random((n, 2)) * 1000
+    centers = rng.random((max(n // 1000, 1), 2)) * 1000
+    labels = rng.integers(len(centers), size=n)
+    return np.clip(centers[labels] + rng.normal(scale=10, size=(n, 2)), 0, 1000)
+
+
+def frame_for(points):
+    """
+    Frame center and radius used to build a triangulation of points.
+    """
+    low, high = points.min(axis=0), points.max(axis=0)
+    return (low + high) / 2, 50 * max(float(np.max(high - low)), 1.0)
+
+
+def naive_build(points):
+    """
+    Insert points one by one in their given order, returns points/s.
+    """
+    dt = Delaunay(*frame_for(points))
+    start = perf_counter()
+    for p in points:
+        dt.add_point(p)
+    return len(points) / (perf_counter() - start)
+
+
+def bulk_build(points, seed=0):
+    """
+    Insert points with Delaunay.add_points, returns points/s.
+    """
+    dt = Delaunay(*frame_for(points))
+    return dt.add_points(points, seed=seed)
+
+
+def parallel_build(points, workers, seed=0):
+    """
+    Triangulate points with triangulate_parallel, returns seconds.
+    """
+    start = perf_counter()
+    triangulate_parallel(points, *frame_for(points), workers=workers, seed=seed)
+    return perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--distribution", choices=["uniform", "clustered"], default="uniform")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-naive", action="store_true", help="only run the bulk build")
+    parser.add_argument("--workers", type=int, nargs="+", help="measure the parallel build with these process counts")
+    args = parser.parse_args()
+
+    metrics.verbose = False
+    rng = np.random.default_rng(args.seed)
+    if args.workers:
+        print("%10s %8s %10s %8s" % ("points", "workers", "seconds", "speedup"))
+        for n in args.sizes:
+            points = make_points(n, args.distribution, rng)
+            serial = len(points) / bulk_build(points, args.seed)
+            for workers in args.workers:
+                elapsed = parallel_build(points, workers, args.seed)
+                print("%10d %8d %10.3f %8.2f" % (n, workers, elapsed, serial / elapsed))
+        return
+
+    print("%10s %14s %14s %8s" % ("points", "naive pts/s", "bulk pts/s", "speedup"))
+    for n in args.sizes:
+        points = make_points(n, args.distribution, rng)
+        bulk = bulk_build(points, args.seed)
+        naive = float("nan") if args.skip_naive else naive_build(points)
+        print("%10d %14.0f %14.0f %8.2f" % (n, naive, bulk, bulk / naive))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Build time and peak memory of the SegmentTree on a point file.
+
+Usage (from the repository root):
+    python -m benchmarks.segment_tree --file Lab1/data/1000000points --engine array
+"""
+import argparse
+from functools import partial
+
+from instrumentation import metrics
+from Lab1.array_tree import ArraySegmentTree
+from Lab1.grid_index import GridIndex
+from Lab1.main import SegmentTree, load_points, read_data_from_file
+
+ENGINES = {"object": SegmentTree, "array": ArraySegmentTree, "grid": GridIndex}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", default="Lab1/data/1000000points")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="object")
+    parser.add_argument("--workers", type=int, default=1, help="build processes, array engine only")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, it slows the build down")
+    parser.add_argument("--json", help="write the recorded spans and counters to this JSON file")
+    parser.add_argument("--csv", help="write the recorded spans and counters to this CSV file")
+    args = parser.parse_args()
+
+    metrics.enabled = True
+    metrics.verbose = False
+    if args.engine != "object":
+        points_list, search_list = load_points(args.file)
+    else:
+        points_list, search_list = read_data_from_file(args.file)
+    engine = ENGINES[args.engine]
+    if args.workers > 1 and args.engine == "array":
+        engine = partial(engine, workers=args.workers)
+    # Only the build is traced, loading under tracemalloc is much slower
+    metrics.trace_memory = not args.no_memory
+    tree = engine(points_list, search_list)
+    metrics.trace_memory = False
+    tree.query()
+
+    print("points: %d" % len(points_list))
+    for record in metrics.spans:
+        line = "%s%s: %.4f s" % ("  " * record["depth"], record["phase"], record["seconds"])
+        if "peak_bytes" in record:
+            line += ", peak memory: %.1f MiB" % (record["peak_bytes"] / 2 ** 20)
+        print(line)
+    for name, value in sorted(metrics.counters.items()):
+        print("%s: %d" % (name, value))
+    print("points found: %d" % len(tree.result))
+    if args.json:
+        metrics.to_json(args.json)
+    if args.csv:
+        metrics.to_csv(args.csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Scaling benchmark of the range search trees and the Delaunay triangulation
+over sizes and distributions of points, with query rectangles of a given
+selectivity (expected fraction of the points inside). The auto engine runs
+the one choose_index picks from the selectivity and the distribution.
+
+Every count is checked against a brute force NumPy search. Each measure
+repeats its call for at least --min-seconds, the median of --repeat such
+runs is kept: the fastest one follows bursts of the machine. Build and
+query throughputs are compared with a stored baseline, and the run fails
+when the mean over the cases of an engine drops by more than the tolerance,
+or a single case by more than the case tolerance. Scipy's cKDTree and
+Delaunay are measured on the same inputs as references when scipy is
+installed, they are reported but not compared. The triangulations are not
+checked, their ok column shows "-".
+
+Usage (from the repository root):
+    python -m benchmarks.suite --sizes 1000 10000 100000 --save-baseline
+    python -m benchmarks.suite --sizes 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from instrumentation import metrics
+from Lab1.array_tree import ArraySegmentTree
+from Lab1.data.pointGen import DISTRIBUTIONS, generate_chunks
+from Lab1.grid_index import GridIndex, choose_index
+from Lab1.main import SegmentTree
+from Lab2.delaunay import Delaunay
+
+try:
+    from scipy.spatial import Delaunay as ScipyDelaunay, cKDTree
+except ImportError:
+    ScipyDelaunay = cKDTree = None
+
+ENGINES = {"object": SegmentTree, "array": ArraySegmentTree, "grid": GridIndex}
+# Engine picked by choose_index for each case
+AUTO = "auto"
+# Coordinates of the generated points are in [0, HIGH)
+HIGH = 1 << 20
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+# Reference engines, left out of the baseline comparison
+REFERENCES = ("ckdtree", "scipy-delaunay")
+# Shortest wall time of a measure, sub-millisecond calls are repeated
+MIN_SECONDS = 0.2
+
+
+def make_points(n, distribution, seed):
+    """
+    (n, 2) int64 points of a pointGen distribution.
+    """
+    chunks = list(generate_chunks(n, 0, HIGH, distribution, seed))
+    return np.concatenate(chunks) if chunks else np.zeros((0, 2), dtype=np.int64)
+
+
+def make_rects(points, selectivity, count, rng):
+    """
+    (count, 2, 2) corners of squares centered on random points, with
+    integer half side h so the square [c - h, c + h]^2 holds about the
+    selectivity fraction of uniform points.
+    """
+    half = max(int(np.sqrt(selectivity) * HIGH / 2), 0)
+    centers = points[rng.integers(len(points), size=count)]
+    return np.stack((centers - half, centers + half), axis=1), centers, half
+
+
+def oracle_counts(points, rects):
+    """
+    Brute force number of points inside each rectangle.
+    """
+    xs, ys = points[:, 0], points[:, 1]
+    return np.array([np.count_nonzero((xs >= low[0]) & (xs <= high[0]) & (ys >= low[1]) & (ys <= high[1]))
+                     for low, high in rects], dtype=np.int64)
+
+
+def median_span(phase, name, func, repeat=1, memory=False, min_seconds=MIN_SECONDS):
+    """
+    Measure func() in repeat instrumentation spans, each calling it until
+    min_seconds have passed, and keep the median seconds per call. When
+    memory, one more call traces the peak memory, untimed since tracing
+    slows it down. Returns the last result and the median record, with
+    the traced peak.
+    """
+    peak = 0
+    if memory:
+        metrics.trace_memory = True
+        try:
+            with metrics.span(phase, name):
+                func()
+        finally:
+            metrics.trace_memory = False
+        peak = metrics.spans[-1].get("peak_bytes", 0)
+    records = []
+    for _ in range(repeat):
+        calls = 0
+        with metrics.span(phase, name):
+            start = perf_counter()
+            while not calls or perf_counter() - start < min_seconds:
+                result = func()
+                calls += 1
+        record = dict(metrics.spans[-1], calls=calls)
+        record["seconds"] /= calls
+        records.append(record)
+    records.sort(key=lambda record: record["seconds"])
+    return result, dict(records[len(records) // 2], peak_bytes=peak)
+
+
+def throughput(count, build, query=None, queries=0):
+    """
+    Record of a case from its build and query spans.
+    """
+    record = {"build_pts_s": count / build["seconds"], "build_peak_mib": build["peak_bytes"] / 2 ** 20}
+    if query is not None:
+        record["queries_s"] = queries / query["seconds"]
+    return record
+
+
+def bench_tree(engine, points, rects, expected, repeat=1, memory=False, min_seconds=MIN_SECONDS):
+    """
+    Build an engine and answer the rectangles, first counting them to check
+    against the oracle, then reporting the points.
+    """
+    tree, build = median_span("build", engine, lambda: ENGINES[engine](points), repeat, memory, min_seconds)
+    counts = np.asarray(tree.query_many(rects, count_only=True))
+    _, query = median_span("query", engine, lambda: tree.query_many(rects), repeat, min_seconds=min_seconds)
+    return dict(throughput(len(points), build, query, len(rects)), ok=bool(np.array_equal(counts, expected)))
+
+
+def bench_kdtree(points, centers, half, expected, repeat=1, memory=False, min_seconds=MIN_SECONDS):
+    """
+    Scipy cKDTree reference: a closed square is a ball of the max norm.
+    """
+    tree, build = median_span("build", "cKDTree", lambda: cKDTree(points), repeat, memory, min_seconds)
+    counts = tree.query_ball_point(centers, half, p=np.inf, return_length=True)
+    _, query = median_span("query", "cKDTree", lambda: tree.query_ball_point(centers, half, p=np.inf), repeat,
+                         min_seconds=min_seconds)
+    return dict(throughput(len(points), build, query, len(centers)), ok=bool(np.array_equal(counts, expected)))
+
+
+def bench_delaunay(points, seed, repeat=1, memory=False, min_seconds=MIN_SECONDS):
+    """
+    Build the triangulation in bulk, and with scipy when installed, on the
+    distinct points. Both numbers of triangles are reported: they can differ
+    along the convex hull, which the frame of Delaunay does not keep.
+    """
+    points = np.unique(points.astype(float), axis=0)
+    low, high = points.min(axis=0), points.max(axis=0)
+    frame = ((low + high) / 2, 50 * max(float(np.max(high - low)), 1.0))
+
+    def build():
+        dt = Delaunay(*frame)
+        dt.add_points(points, seed=seed)
+        return dt
+
+    dt, record = median_span("build", "Delaunay", build, repeat, memory, min_seconds)
+    result = {"delaunay": dict(throughput(len(points), record), triangles=len(dt.get_triangles()))}
+    if ScipyDelaunay is not None and len(points) >= 3:
+        reference, record = median_span("build", "scipy", lambda: ScipyDelaunay(points), repeat, memory,
+                                      min_seconds)
+        result["scipy-delaunay"] = dict(throughput(len(points), record), triangles=len(reference.simplices))
+    return result
+
+
+def compare(results, baseline, tolerance, case_tolerance):
+    """
+    Throughputs that dropped compared with the baseline: per engine and
+    measure, the geometric mean of the ratios over the cases of both runs
+    below 1 - tolerance, or a single case below 1 - case_tolerance. Single
+    cases of sub-second measures move by a third between identical runs,
+    their mean hardly does. Reference engines are left out.
+    """
+    regressions = []
+    ratios = {}
+    for key, record in results.items():
+        if key.startswith(REFERENCES):
+            continue
+        before = baseline.get(key, {})
+        for name in ("build_pts_s", "queries_s"):
+            if name in record and name in before:
+                ratio = record[name] / before[name]
+                ratios.setdefault((key.split("/")[0], name), []).append(ratio)
+                if ratio < 1 - case_tolerance:
+                    regressions.append("%s %s: %.0f < %.0f" % (key, name, record[name], before[name]))
+    for (engine, name), values in sorted(ratios.items()):
+        mean = float(np.exp(np.mean(np.log(values))))
+        if mean < 1 - tolerance:
+            regressions.append("%s %s: %.2f times the baseline over %d cases" % (engine, name, mean, len(values)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--distributions", choices=DISTRIBUTIONS, nargs="+", default=DISTRIBUTIONS)
+    parser.add_argument("--selectivity", type=float, nargs="+", default=[1e-4, 1e-2],
+                        help="expected fractions of the points inside the query rectangles")
+    parser.add_argument("--queries", type=int, default=200, help="rectangles per selectivity")
+    parser.add_argument("--engines", choices=sorted(ENGINES) + [AUTO], nargs="+", default=sorted(ENGINES) + [AUTO])
+    parser.add_argument("--object-max", type=int, default=10 ** 6, help="largest size for the object engine")
+    parser.add_argument("--delaunay-max", type=int, default=10 ** 5, help="largest size for the triangulation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measure, the median one is kept")
+    parser.add_argument("--min-seconds", type=float, default=MIN_SECONDS, help="shortest wall time of a run")
+    parser.add_argument("--memory", action="store_true", help="trace the build peak memory, slows builds down so "
+                                                                "compare with a baseline run the same way")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline JSON file to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="allowed relative drop of the mean throughput of an engine")
+    parser.add_argument("--case-tolerance", type=float, default=0.6,
+                        help="allowed relative throughput drop of a single case")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    metrics.enabled = True
+    metrics.verbose = False
+    results = {}
+    failures = []
+    print("%-40s %14s %10s %14s %4s" % ("case", "build pts/s", "peak MiB", "queries/s", "ok"))
+
+    def report(key, record):
+        results[key] = record
+        queries = "%14.0f" % record["queries_s"] if "queries_s" in record else "%14s" % "-"
+        # Records without a check, the triangulations, are neither passed nor failed
+        ok = record.get("ok")
+        if ok is False:
+            failures.append(key)
+        print("%-40s %14.0f %10.1f %s %4s" % (key, record["build_pts_s"], record["build_peak_mib"], queries,
+                                             "-" if ok is None else "yes" if ok else "NO"))
+
+    for n in args.sizes:
+        for distribution in args.distributions:
+            points = make_points(n, distribution, args.seed)
+            for selectivity in args.selectivity:
+                # Same rectangles for a case whatever else runs
+                rng = np.random.default_rng([args.seed, n, DISTRIBUTIONS.index(distribution), int(1e9 * selectivity)])
+                rects, centers, half = make_rects(points, selectivity, args.queries, rng)
+                start = perf_counter()
+                expected = oracle_counts(points, rects)
+                key = "%s/%d/%g" % (distribution, n, selectivity)
+                print("# %s: %.1f points per query, oracle %.3f s" % (key, expected.mean(), perf_counter() - start))
+                measure = (args.repeat, args.memory, args.min_seconds)
+                for engine in args.engines:
+                    if engine == "object" and n > args.object_max:
+                        continue
+                    if engine == AUTO:
+                        chosen = choose_index(points, selectivity)
+                        name = next(name for name, index in ENGINES.items() if index is chosen)
+                        record = dict(bench_tree(name, points, rects, expected, *measure), engine=name)
+                        print("# %s: auto picks %s" % (key, name))
+                    else:
+                        record = bench_tree(engine, points, rects, expected, *measure)
+                    report("%s/%s" % (engine, key), record)
+                if cKDTree is not None:
+                    record = bench_kdtree(points, centers, half, expected, *measure)
+                    report("ckdtree/%s" % key, record)
+            if n <= args.delaunay_max:
+                for name, record in bench_delaunay(points, args.seed, args.repeat, args.memory,
+                                                   args.min_seconds).items():
+                    report("%s/%s/%d" % (name, distribution, n), record)
+
+    if args.json:
+        with open(args.json, mode="w") as json_file:
+            json.dump(results, json_file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, mode="w") as json_file:
+            json.dump(results, json_file, indent=2)
+        print("Baseline saved as %s" % args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as json_file:
+            regressions = compare(results, json.load(json_file), args.tolerance, args.case_tolerance)
+        for line in regressions:
+            print("REGRESSION %s" % line)
+        failures += regressions
+    if failures:
+        print("%d failed checks" % len(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Timing, counters and memory peaks shared by the labs.
+
+    from instrumentation import metrics, timed
+
+    @timed('build')
+    def build(...): ...
+
+    with metrics.span('query'):
+        ...
+    metrics.count('nodes_visited', visited)
+    metrics.to_json('metrics.json')
+
+Spans use the monotonic perf_counter and nest: each one records its depth
+and phase. A recursive timed function is only measured by its outermost
+call. Only the last max_spans records are kept, calls, total and longest
+seconds are aggregated per phase and name over all of them, so timing a
+query loop does not grow memory. With trace_memory the peak of memory
+traced by tracemalloc is kept per span. Set LABS_METRICS=0 in the
+environment, or metrics.enabled to False, to turn everything off;
+LABS_METRICS_VERBOSE=1, or metrics.verbose, prints each span as it ends.
+"""
+import csv
+import json
+import os
+import tracemalloc
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+
+# Span records kept by default, older ones only count in the totals
+MAX_SPANS = 10000
+
+
+class Metrics:
+    """
+    Recorded spans and counters, see the module documentation.
+    """
+
+    def __init__(self, enabled: bool = True, verbose: bool = False, trace_memory: bool = False,
+                 max_spans: int = MAX_SPANS):
+        self.enabled = enabled
+        self.verbose = verbose
+        self.trace_memory = trace_memory
+        self.spans = deque(maxlen=max_spans)
+        # Per phase and per (phase, name) aggregates of all the spans
+        self.phases = {}
+        self.totals = {}
+        self.counters = Counter()
+        # Open spans, each as [phase, memory peak seen so far]
+        self._stack = []
+
+    def reset(self):
+        """
+        Forget the recorded spans, totals and counters.
+        """
+        self.spans.clear()
+        self.phases = {}
+        self.totals = {}
+        self.counters = Counter()
+
+    def count(self, name: str, value: int = 1):
+        """
+        Add value to counter name.
+        """
+        if self.enabled:
+            self.counters[name] += value
+
+    @contextmanager
+    def span(self, phase: str, name: str = None):
+        """
+        Measure the block as a span of phase (load, build, query, plot...),
+        named after the phase unless name is given.
+        """
+        if not self.enabled:
+            yield
+            return
+        name = name or phase
+        memory = self.trace_memory
+        started = False
+        if memory:
+            if not tracemalloc.is_tracing():
+                # Tracing slows everything down, it stops with this span
+                tracemalloc.start()
+                started = True
+            # The peak is reset for the new span, keep the parent's one
+            if self._stack:
+                self._stack[-1][1] = max(self._stack[-1][1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        parent = self._stack[-1][0] if self._stack else None
+        frame = [phase, 0]
+        self._stack.append(frame)
+        depth = len(self._stack) - 1
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            self._stack.pop()
+            record = {'phase': phase, 'name': name, 'parent': parent, 'depth': depth, 'seconds': seconds}
+            if memory and tracemalloc.is_tracing():
+                peak = max(frame[1], tracemalloc.get_traced_memory()[1])
+                record['peak_bytes'] = peak
+                if self._stack:
+                    self._stack[-1][1] = max(self._stack[-1][1], peak)
+                if started:
+                    tracemalloc.stop()
+            self.spans.append(record)
+            self.add_totals(record)
+            if self.verbose:
+                line = '%s%s [%s] took %.6f s' % ('  ' * depth, name, phase, seconds)
+                if 'peak_bytes' in record:
+                    line += ', peak %.1f MiB' % (record['peak_bytes'] / 2 ** 20)
+                print(line)
+
+    def timed(self, phase: str = None):
+        """
+        Decorator measuring each outermost call of a function as a span,
+        named after the function.
+        """
+
+        def decorator(func):
+            name = func.__qualname__
+            depth = [0]
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or depth[0]:
+                    return func(*args, **kwargs)
+                depth[0] += 1
+                try:
+                    with self.span(phase or name, name):
+                        return func(*args, **kwargs)
+                finally:
+                    depth[0] -= 1
+
+            return wrapper
+
+        return decorator
+
+    def add_totals(self, record: dict):
+        """
+        Add a span record to the per phase and per (phase, name) totals. A
+        span nested in a span of the same phase only adds its call to the
+        phase.
+        """
+        phase = self.phases.setdefault(record['phase'], {'calls': 0, 'seconds': 0.0})
+        phase['calls'] += 1
+        if record['parent'] != record['phase']:
+            phase['seconds'] += record['seconds']
+        total = self.totals.setdefault((record['phase'], record['name']),
+                                       {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+        total['calls'] += 1
+        total['seconds'] += record['seconds']
+        total['max_seconds'] = max(total['max_seconds'], record['seconds'])
+
+    def summary(self) -> dict:
+        """
+        Total seconds and calls per phase, and the counters.
+        """
+        return {'phases': {phase: dict(total) for phase, total in self.phases.items()},
+                'counters': dict(self.counters)}
+
+    def totals_list(self) -> list:
+        """
+        Calls, total and longest seconds of each phase and name.
+        """
+        return [dict(total, phase=phase, name=name) for (phase, name), total in self.totals.items()]
+
+    def to_json(self, filepath: str):
+        """
+        Write the kept spans, the totals and the counters as a JSON document.
+        """
+        with open(filepath, mode='w') as json_file:
+            json.dump({'spans': list(self.spans), 'totals': self.totals_list(), 'counters': dict(self.counters)},
+                      json_file, indent=2)
+
+    def to_csv(self, filepath: str):
+        """
+        Write one row per kept span, then one per total and per counter.
+        """
+        with open(filepath, mode='w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['kind', 'phase', 'name', 'parent', 'depth', 'seconds', 'peak_bytes', 'value',
+                             'max_seconds'])
+            for record in self.spans:
+                writer.writerow(['span', record['phase'], record['name'], record['parent'] or '', record['depth'],
+                                 record['seconds'], record.get('peak_bytes', ''), '', ''])
+            for total in self.totals_list():
+                writer.writerow(['total', total['phase'], total['name'], '', '', total['seconds'], '',
+                                 total['calls'], total['max_seconds']])
+            for name, value in sorted(self.counters.items()):
+                writer.writerow(['counter', '', name, '', '', '', '', value, ''])
+
+
+# Shared by both labs and the benchmarks
+metrics = Metrics(enabled=os.environ.get('LABS_METRICS', '1') != '0',
+                  verbose=os.environ.get('LABS_METRICS_VERBOSE', '0') == '1')
+span = metrics.span
+timed = metrics.timed